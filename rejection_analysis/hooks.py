@@ -137,17 +137,48 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+	"Item Price": {
+		"on_update": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_item_price_cache",
+		"on_trash": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_item_price_cache"
+	},
+	"Work Planning": {
+		"on_submit": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_work_planning_lots_cache",
+		"on_cancel": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_work_planning_lots_cache"
+	},
+	"Add On Work Planning": {
+		"on_submit": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_work_planning_lots_cache",
+		"on_cancel": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_work_planning_lots_cache"
+	},
+	"Moulding Production Entry": {
+		"on_submit": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_cost_analysis_cache",
+		"on_cancel": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_cost_analysis_cache"
+	},
+	"Inspection Entry": {
+		"on_submit": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_cost_analysis_cache",
+		"on_cancel": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_cost_analysis_cache"
+	},
+	"SPP Inspection Entry": {
+		"on_submit": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_cost_analysis_cache",
+		"on_cancel": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_cost_analysis_cache"
+	},
+	"Rejection Analysis Settings": {
+		"on_update": "rejection_analysis.rejection_analysis.cost_analysis_api.clear_pricing_config_cache"
+	}
+}
 
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"hourly": [
+		"rejection_analysis.rejection_analysis.cost_analysis_api.sync_remote_item_prices"
+	],
+	"daily": [
+		"rejection_analysis.rejection_analysis.data_discovery.refresh_data_patterns"
+	],
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"rejection_analysis.tasks.all"
@@ -247,7 +278,10 @@ app_license = "mit"
 # --------------------
 # Run patches after migrate
 after_migrate = [
-    "rejection_analysis.patches.add_work_planning_indexes.execute"
+    "rejection_analysis.patches.add_work_planning_indexes.execute",
+    "rejection_analysis.patches.add_lot_split_columns.execute",
+    "rejection_analysis.patches.add_cost_analysis_indexes.execute",
+    "rejection_analysis.patches.add_daily_report_unique_key.execute"
 ]
 
 website_route_rules = [{'from_route': '/rejection_analysis_console/<path:app_path>', 'to_route': 'rejection_analysis_console'},]
\ No newline at end of file
@@ -2,51 +2,63 @@
 Database Indexes for Cost Analysis Performance
 
 This patch adds indexes for Cost Analysis queries to improve performance.
+
+Each index is created by its own idempotent statement and errors are not
+caught, so a failure stops the migration and is retried on the next run.
+The superseded indexes are only dropped once their replacements exist.
 """
 
 import frappe
 
+# (table, index name, columns)
+COST_ANALYSIS_INDEXES = (
+    # Moulding Production Entry moulding_date
+    ("tabMoulding Production Entry", "idx_mpe_moulding_date", "moulding_date, docstatus"),
+    # Moulding Production Entry lot (for the moulding stage IN clause)
+    ("tabMoulding Production Entry", "idx_mpe_scan_lot", "scan_lot_number, docstatus"),
+    # Date-driven lookups from moulding into inspections (rejection trends)
+    ("tabMoulding Production Entry", "idx_mpe_date_lot_status", "moulding_date, scan_lot_number, docstatus"),
+    # Inspection Entry lot for joins from moulding rows
+    ("tabInspection Entry", "idx_ie_lot_type_status", "lot_no, inspection_type, docstatus"),
+    # Inspection Entry posting_date and inspection_type
+    ("tabInspection Entry", "idx_ie_posting_date_type", "posting_date, inspection_type, docstatus"),
+    # SPP Inspection Entry posting_date
+    ("tabSPP Inspection Entry", "idx_spp_posting_date", "posting_date, inspection_type, docstatus"),
+    # Covering index for the stage queries: equality on type/status, IN on lot, ordered by date
+    ("tabInspection Entry", "idx_ie_type_status_lot_date", "inspection_type, docstatus, lot_no, posting_date"),
+    # FVI matches on the main lot (main_lot_g from add_lot_split_columns)
+    ("tabSPP Inspection Entry", "idx_spp_type_status_lot_date", "inspection_type, docstatus, main_lot_g, posting_date"),
+    # Covering indexes on the defect child tables for defect lookups and per-defect sums
+    ("tabInspection Entry Item", "idx_iei_parent_defect_qty", "parent, type_of_defect, rejected_qty"),
+    ("tabFV Inspection Entry Item", "idx_fvi_parent_defect_qty", "parent, type_of_defect, rejected_qty"),
+    # Blanking lookups by bin: the entry header (investigate_blanking) and the
+    # Blanking DC Item rows used by operator traceability
+    ("tabBlanking DC Entry", "idx_blanking_bin_status_date", "bin_code, docstatus, posting_date"),
+    ("tabBlanking DC Item", "idx_bdi_bin_item", "bin_code, t_item_to_produce"),
+)
+
+# (table, index name) made redundant by the covering indexes above
+SUPERSEDED_INDEXES = (
+    ("tabInspection Entry Item", "idx_iei_parent_defect"),
+    ("tabFV Inspection Entry Item", "idx_fvi_parent_defect"),
+)
+
 def execute():
     """Add database indexes for Cost Analysis queries"""
-    
+
     if not frappe.db:
         return
-    
-    try:
-        # Index on Moulding Production Entry moulding_date
-        frappe.db.sql("""
-            CREATE INDEX IF NOT EXISTS idx_mpe_moulding_date 
-            ON `tabMoulding Production Entry` (moulding_date, docstatus)
-        """)
-        
-        # Index on Inspection Entry posting_date and inspection_type
-        frappe.db.sql("""
-            CREATE INDEX IF NOT EXISTS idx_ie_posting_date_type 
-            ON `tabInspection Entry` (posting_date, inspection_type, docstatus)
-        """)
-        
-        # Index on SPP Inspection Entry posting_date
-        frappe.db.sql("""
-            CREATE INDEX IF NOT EXISTS idx_spp_posting_date 
-            ON `tabSpp Inspection Entry` (posting_date, inspection_type, docstatus)
-        """)
-        
-        # Index on Inspection Entry Item for defect lookups
-        frappe.db.sql("""
-            CREATE INDEX IF NOT EXISTS idx_iei_parent_reason 
-            ON `tabInspection Entry Item` (parent, rejection_reason)
-        """)
-        
-        # Index on SPP Inspection Entry Item for defect lookups
-        frappe.db.sql("""
-            CREATE INDEX IF NOT EXISTS idx_sei_parent_reason 
-            ON `tabSpp Inspection Entry Item` (parent, rejection_reason)
+
+    for table, index_name, columns in COST_ANALYSIS_INDEXES:
+        frappe.db.sql(f"""
+            ALTER TABLE `{table}`
+            ADD INDEX IF NOT EXISTS {index_name} ({columns})
         """)
-        
-        frappe.db.commit()
-        
-        print("✅ Cost Analysis indexes created successfully")
-        
-    except Exception as e:
-        print(f"❌ Error creating indexes: {str(e)}")
-        frappe.log_error("Cost Analysis Index Creation Failed", str(e))
+
+    # Reached only when every replacement above was created
+    for table, index_name in SUPERSEDED_INDEXES:
+        frappe.db.sql(f"DROP INDEX IF EXISTS {index_name} ON `{table}`")
+
+    frappe.db.commit()
+
+    print("✅ Cost Analysis indexes created successfully")
@@ -0,0 +1,54 @@
+"""
+Unique Report Date Key for Daily Rejection Report
+
+generate_comprehensive_daily_report creates one report per date. Its
+existence check and insert are separate statements, so two concurrent
+callers could both pass the check. A unique key makes the database reject
+the second insert.
+
+Only draft and submitted reports take part: the key is on a stored
+generated column that holds report_date while docstatus < 2 and NULL once
+the report is cancelled. NULLs never collide, so a date can carry any
+number of cancelled reports and still be amended.
+
+generate_comprehensive_daily_report relies on this key, so failures are
+raised and stop the migration instead of being printed and skipped.
+"""
+
+import frappe
+
+def execute():
+    """Add the active report date column and its unique key to Daily Rejection Report"""
+
+    if not frappe.db:
+        return
+
+    try:
+        # Superseded key on (report_date, docstatus): it rejected a second cancelled report for a date
+        frappe.db.sql("""
+            DROP INDEX IF EXISTS uq_drr_date_status
+            ON `tabDaily Rejection Report`
+        """)
+
+        frappe.db.sql("""
+            ALTER TABLE `tabDaily Rejection Report`
+            ADD COLUMN IF NOT EXISTS active_report_date_g DATE GENERATED ALWAYS AS (
+                IF(docstatus < 2, report_date, NULL)
+            ) STORED
+        """)
+
+        frappe.db.sql("""
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_drr_active_report_date
+            ON `tabDaily Rejection Report` (active_report_date_g)
+        """)
+
+        frappe.db.commit()
+
+        print("✅ Daily Rejection Report unique key created successfully")
+        print("   - uq_drr_active_report_date: (active_report_date_g)")
+
+    except Exception as e:
+        # Fails if more than one draft/submitted report already exists for a date; resolve those first
+        frappe.db.rollback()
+        frappe.log_error("Daily Report Unique Key Creation Failed", str(e))
+        raise
@@ -0,0 +1,72 @@
+"""
+Generated Lot Split Columns for Drill Down Report Performance
+
+This patch adds stored generated columns holding the main lot and sublot
+parts of lot_no on Inspection Entry and SPP Inspection Entry, so the drill
+down queries no longer re-evaluate the split expressions on every scan.
+
+Lot formats:
+    - Inspection Entry: 25H06Y01-3 or 25H06Y01/3
+    - SPP Inspection Entry: 25H06Y01-3
+"""
+
+import frappe
+
+def execute():
+    """Add generated main lot / sublot columns and index the main lot"""
+    
+    if not frappe.db:
+        return
+    
+    try:
+        # Inspection Entry: split on '-' first, then '/'
+        frappe.db.sql("""
+            ALTER TABLE `tabInspection Entry`
+            ADD COLUMN IF NOT EXISTS main_lot_g VARCHAR(140) GENERATED ALWAYS AS (
+                CASE
+                    WHEN LOCATE('-', lot_no) > 0 THEN SUBSTRING_INDEX(lot_no, '-', 1)
+                    WHEN LOCATE('/', lot_no) > 0 THEN SUBSTRING_INDEX(lot_no, '/', 1)
+                    ELSE lot_no
+                END
+            ) STORED,
+            ADD COLUMN IF NOT EXISTS sublot_number_g VARCHAR(140) GENERATED ALWAYS AS (
+                CASE
+                    WHEN LOCATE('-', lot_no) > 0 THEN SUBSTRING_INDEX(lot_no, '-', -1)
+                    WHEN LOCATE('/', lot_no) > 0 THEN SUBSTRING_INDEX(lot_no, '/', -1)
+                    ELSE '1'
+                END
+            ) STORED
+        """)
+        
+        frappe.db.sql("""
+            CREATE INDEX IF NOT EXISTS idx_main_lot_g 
+            ON `tabInspection Entry` (main_lot_g)
+        """)
+        
+        # SPP Inspection Entry: sublots only use '-'
+        frappe.db.sql("""
+            ALTER TABLE `tabSPP Inspection Entry`
+            ADD COLUMN IF NOT EXISTS main_lot_g VARCHAR(140) GENERATED ALWAYS AS (
+                CASE WHEN LOCATE('-', lot_no) > 0 THEN SUBSTRING_INDEX(lot_no, '-', 1) ELSE lot_no END
+            ) STORED,
+            ADD COLUMN IF NOT EXISTS sublot_number_g VARCHAR(140) GENERATED ALWAYS AS (
+                CASE WHEN LOCATE('-', lot_no) > 0 THEN SUBSTRING_INDEX(lot_no, '-', -1) ELSE '1' END
+            ) STORED
+        """)
+        
+        frappe.db.sql("""
+            CREATE INDEX IF NOT EXISTS idx_main_lot_g 
+            ON `tabSPP Inspection Entry` (main_lot_g)
+        """)
+        
+        frappe.db.commit()
+        
+        print("✅ Lot split columns created successfully")
+        print("   - Inspection Entry: main_lot_g, sublot_number_g")
+        print("   - SPP Inspection Entry: main_lot_g, sublot_number_g")
+        
+    except Exception as e:
+        # The drill down and FVI stage queries select these columns unconditionally,
+        # so a failure must stop the migration rather than surface later as "Unknown column"
+        frappe.log_error("Lot Split Column Creation Failed", str(e))
+        raise
@@ -18,7 +18,9 @@ Date: November 26, 2025
 import frappe
 import json
 import re
+from collections import defaultdict
 from datetime import datetime, timedelta
+from operator import itemgetter
 from frappe import _
 from frappe.utils import today, getdate, flt, add_days, nowdate, get_datetime
 
@@ -70,11 +72,16 @@ def get_sample_mpe_data(limit=50):
                            fields=['name','moulding_date','scan_lot_number','operator','employee_name','job_card','batch_details','number_of_lifts','mould_reference','item_to_produce'], 
                            limit=limit, order_by='creation desc')
     
+    # Fetch shifts for all Job Cards in one query
+    job_cards = {record['job_card'] for record in mpe_list if record.get('job_card')}
+    shifts = dict(frappe.get_all('Job Card', filters={'name': ['in', list(job_cards)]},
+                                 fields=['name', 'shift_number'], as_list=True)) if job_cards else {}
+    
     results = []
     for record in mpe_list:
         # Get shift from Job Card
         if record.get('job_card'):
-            record['shift'] = frappe.db.get_value('Job Card', record['job_card'], 'shift_number')
+            record['shift'] = shifts.get(record['job_card'])
         
         # Parse batch details
         if record.get('batch_details'):
@@ -175,7 +182,7 @@ def list_recent_mtis():
                              filters={'parenttype': 'Cut Bit Transfer'})
 @frappe.whitelist()
 @frappe.whitelist()
-def get_traceable_sample_set(limit=5, from_date=None, to_date=None, date=None):
+def get_traceable_sample_set(limit=5, from_date=None, to_date=None, date=None, lot_no=None):
     """
     Get operator traceability data for incentive calculations.
     
@@ -184,6 +191,7 @@ def get_traceable_sample_set(limit=5, from_date=None, to_date=None, date=None):
         from_date: Start date for range filter (YYYY-MM-DD)
         to_date: End date for range filter (YYYY-MM-DD)
         date: Single date filter (YYYY-MM-DD), overrides from_date/to_date if provided
+        lot_no: Restrict to a single lot number
     """
     # Build date filters
     filters = {'docstatus': 1}
@@ -201,6 +209,9 @@ def get_traceable_sample_set(limit=5, from_date=None, to_date=None, date=None):
         # To date only
         filters['moulding_date'] = ['<=', to_date]
     
+    if lot_no:
+        filters['scan_lot_number'] = lot_no
+    
     # Increase fetching buffer to ensure we meet the requested limit after filtering
     fetch_limit = int(limit) * 4 if limit else 200
     
@@ -209,6 +220,11 @@ def get_traceable_sample_set(limit=5, from_date=None, to_date=None, date=None):
                            fields=['name','moulding_date','scan_lot_number','operator','employee_name','job_card','batch_details','number_of_lifts','mould_reference','item_to_produce', 'creation'], 
                            limit=fetch_limit, order_by='creation desc')
     
+    # Fetch shifts for all Job Cards in one query
+    job_cards = {mpe['job_card'] for mpe in mpe_list if mpe.get('job_card')}
+    shifts = dict(frappe.get_all('Job Card', filters={'name': ['in', list(job_cards)]},
+                                 fields=['name', 'shift_number'], as_list=True)) if job_cards else {}
+    
     results = []
     for mpe in mpe_list:
         if len(results) >= int(limit or 5): break
@@ -217,7 +233,7 @@ def get_traceable_sample_set(limit=5, from_date=None, to_date=None, date=None):
         prod_start, prod_end = decode_lot_number(mpe['scan_lot_number'])
         
         # Get shift
-        shift = frappe.db.get_value('Job Card', mpe['job_card'], 'shift_number') if mpe.get('job_card') else ""
+        shift = shifts.get(mpe['job_card']) if mpe.get('job_card') else ""
         
         # Parse batches
         batch_details = []
@@ -447,6 +463,10 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
         date_condition = "= %s"
         date_params = (date or today(),)
     
+    # Moulding date filter as a plain range so the moulding_date index can be used
+    moulding_date_condition = "mpe.moulding_date >= %s AND mpe.moulding_date < DATE_ADD(%s, INTERVAL 1 DAY)"
+    moulding_date_params = (date_params[0], date_params[-1])
+    
     # Initialize default result structure
     metrics = {
         "total_lots": 0,
@@ -475,14 +495,14 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
                 ON mpe.scan_lot_number = ie.lot_no
             WHERE ie.inspection_type = 'Lot Inspection'
             AND ie.docstatus = 1
-            AND DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') {date_condition}
+            AND {moulding_date_condition}
         """
-        inspections = frappe.db.sql(query, date_params, as_dict=True)
+        inspections = frappe.db.sql(query, moulding_date_params, as_dict=True)
         
         # 2. Calculate Basic Metrics
         metrics["total_lots"] = len(inspections)
-        metrics["total_inspected_qty"] = sum([flt(i.total_inspected_qty_nos) for i in inspections])
-        metrics["total_rejected_qty"] = sum([flt(i.total_rejected_qty) for i in inspections])
+        metrics["total_inspected_qty"] = sum(flt(i.total_inspected_qty_nos) for i in inspections)
+        metrics["total_rejected_qty"] = sum(flt(i.total_rejected_qty) for i in inspections)
         
         if metrics["total_inspected_qty"] > 0:
             metrics["avg_rejection"] = (metrics["total_rejected_qty"] / metrics["total_inspected_qty"] * 100)
@@ -498,9 +518,9 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
                     ON mpe.scan_lot_number = ie.lot_no
                 WHERE ie.inspection_type = %s
                 AND ie.docstatus = 1
-                AND DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') {date_condition}
+                AND {moulding_date_condition}
             """
-            sub_result = frappe.db.sql(sub_query, (sub_type,) + date_params, as_dict=True)
+            sub_result = frappe.db.sql(sub_query, (sub_type,) + moulding_date_params, as_dict=True)
             avg_val = flt(sub_result[0].avg_rej) if sub_result and sub_result[0].avg_rej else 0.0
             
             if sub_type == 'Patrol Inspection':
@@ -512,7 +532,7 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
         pending_query = f"""
             SELECT COUNT(DISTINCT mpe.scan_lot_number) as pending_count
             FROM `tabMoulding Production Entry` mpe
-            WHERE DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') {date_condition}
+            WHERE {moulding_date_condition}
             AND NOT EXISTS (
                 SELECT 1 FROM `tabInspection Entry` ie 
                 WHERE ie.lot_no = mpe.scan_lot_number 
@@ -520,7 +540,7 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
                 AND ie.docstatus = 1
             )
         """
-        pending_result = frappe.db.sql(pending_query, date_params, as_dict=True)
+        pending_result = frappe.db.sql(pending_query, moulding_date_params, as_dict=True)
         metrics["pending_lots"] = int(flt(pending_result[0].pending_count)) if pending_result else 0
 
     # ========================================================================
@@ -542,8 +562,8 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
         
         # 2. Calculate Basic Metrics
         metrics["total_lots"] = len(inspections)
-        metrics["total_inspected_qty"] = sum([flt(i.total_inspected_qty_nos) for i in inspections])
-        metrics["total_rejected_qty"] = sum([flt(i.total_rejected_qty) for i in inspections])
+        metrics["total_inspected_qty"] = sum(flt(i.total_inspected_qty_nos) for i in inspections)
+        metrics["total_rejected_qty"] = sum(flt(i.total_rejected_qty) for i in inspections)
         
         if metrics["total_inspected_qty"] > 0:
             metrics["avg_rejection"] = (metrics["total_rejected_qty"] / metrics["total_inspected_qty"] * 100)
@@ -557,7 +577,7 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
         pending_query = f"""
             SELECT COUNT(DISTINCT mpe.scan_lot_number) as pending_count
             FROM `tabMoulding Production Entry` mpe
-            WHERE DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') {date_condition}
+            WHERE {moulding_date_condition}
             AND NOT EXISTS (
                 SELECT 1 FROM `tabInspection Entry` ie 
                 WHERE ie.lot_no = mpe.scan_lot_number 
@@ -565,7 +585,7 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
                 AND ie.docstatus = 1
             )
         """
-        pending_result = frappe.db.sql(pending_query, date_params, as_dict=True)
+        pending_result = frappe.db.sql(pending_query, moulding_date_params, as_dict=True)
         metrics["pending_lots"] = int(flt(pending_result[0].pending_count)) if pending_result else 0
 
     # ========================================================================
@@ -587,8 +607,8 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
         
         # 2. Calculate Basic Metrics
         metrics["total_lots"] = len(inspections)
-        metrics["total_inspected_qty"] = sum([flt(i.total_inspected_qty_nos) for i in inspections])
-        metrics["total_rejected_qty"] = sum([flt(i.total_rejected_qty) for i in inspections])
+        metrics["total_inspected_qty"] = sum(flt(i.total_inspected_qty_nos) for i in inspections)
+        metrics["total_rejected_qty"] = sum(flt(i.total_rejected_qty) for i in inspections)
         
         if metrics["total_inspected_qty"] > 0:
             metrics["avg_rejection"] = (metrics["total_rejected_qty"] / metrics["total_inspected_qty"] * 100)
@@ -604,7 +624,7 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
         pending_query = f"""
             SELECT COUNT(DISTINCT mpe.scan_lot_number) as pending_count
             FROM `tabMoulding Production Entry` mpe
-            WHERE DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') {date_condition}
+            WHERE {moulding_date_condition}
             AND NOT EXISTS (
                 SELECT 1 FROM `tabSPP Inspection Entry` spp_ie 
                 WHERE SUBSTRING_INDEX(spp_ie.lot_no, '-', 1) = mpe.scan_lot_number 
@@ -612,7 +632,7 @@ def get_dashboard_metrics(date=None, inspection_type="Lot Inspection", from_date
                 AND spp_ie.docstatus = 1
             )
         """
-        pending_result = frappe.db.sql(pending_query, date_params, as_dict=True)
+        pending_result = frappe.db.sql(pending_query, moulding_date_params, as_dict=True)
         metrics["pending_lots"] = int(flt(pending_result[0].pending_count)) if pending_result else 0
 
     # Round all float values
@@ -656,7 +676,7 @@ def get_aggregate_dashboard_metrics(period="30d", end_date=None):
     prod_query = """
         SELECT COUNT(DISTINCT scan_lot_number) as total
         FROM `tabMoulding Production Entry`
-        WHERE DATE_FORMAT(moulding_date, '%%Y-%%m-%%d') BETWEEN %s AND %s
+        WHERE moulding_date >= %s AND moulding_date < DATE_ADD(%s, INTERVAL 1 DAY)
     """
     prod = frappe.db.sql(prod_query, (start_date, end_date), as_dict=True)
     total_production = int(flt(prod[0].total)) if prod else 0
@@ -671,7 +691,7 @@ def get_aggregate_dashboard_metrics(period="30d", end_date=None):
             FROM `tabInspection Entry` ie
             LEFT JOIN `tabMoulding Production Entry` mpe ON mpe.scan_lot_number = ie.lot_no
             WHERE ie.inspection_type = 'Lot Inspection' AND ie.docstatus = 1
-            AND DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') BETWEEN %s AND %s
+            AND mpe.moulding_date >= %s AND mpe.moulding_date < DATE_ADD(%s, INTERVAL 1 DAY)
             UNION ALL
             SELECT ie.total_inspected_qty_nos, ie.total_rejected_qty,
                    ie.total_rejected_qty_in_percentage
@@ -754,7 +774,7 @@ def get_performance_rankings(period="30d", dimension="machine", limit=10, end_da
             LEFT JOIN `tabMoulding Production Entry` mpe ON mpe.scan_lot_number = ie.lot_no
             LEFT JOIN `tabJob Card` jc ON jc.name = mpe.job_card
             WHERE ie.inspection_type = 'Lot Inspection' AND ie.docstatus = 1
-            AND DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') BETWEEN %s AND %s
+            AND mpe.moulding_date >= %s AND mpe.moulding_date < DATE_ADD(%s, INTERVAL 1 DAY)
             UNION ALL
             SELECT {field}, ie.total_inspected_qty_nos, ie.total_rejected_qty
             FROM `tabInspection Entry` ie
@@ -797,62 +817,27 @@ def fetch_remote_item_prices_batch(item_codes, remote_url, api_key, api_secret):
     Returns:
         dict: Mapping of item_code -> price_list_rate
     """
-    import requests
-    import json
-    from frappe.utils import flt
+    from rejection_analysis.rejection_analysis.cost_analysis_api import (
+        REMOTE_PRICE_CHUNK_SIZE,
+        fetch_remote_price_chunk,
+    )
     
     if not item_codes or not remote_url or not api_key or not api_secret:
         return {}
     
-    try:
-        # Query Item Price for Standard Selling price list
-        filters = [
-            ["item_code", "in", item_codes],
-            ["price_list", "=", "Standard Selling"]
-        ]
-        fields = ["item_code", "price_list_rate"]
-        
-        response = requests.get(
-            f"{remote_url}/api/resource/Item Price",
-            params={
-                "filters": json.dumps(filters),
-                "fields": json.dumps(fields),
-                "limit_page_length": 500
-            },
-            headers={
-                "Authorization": f"token {api_key}:{api_secret}"
-            },
-            timeout=10  # 10 second timeout
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            # Build map of item_code -> price
-            price_map = {}
-            for item_price in data.get("data", []):
-                item_code = item_price.get("item_code")
-                rate = flt(item_price.get("price_list_rate", 0))
-                if item_code and rate > 0:
-                    price_map[item_code] = rate
-            
-            return price_map
-        else:
-            # Truncate response text to prevent character length errors
-            error_text = response.text[:500] if response.text else "No response"
-            frappe.log_error(
-                f"Remote pricing API returned {response.status_code}: {error_text}",
-                "Remote Pricing Fetch Error"
-            )
-            return {}
-            
-    except requests.exceptions.Timeout:
-        frappe.log_error("Remote pricing API timeout after 10 seconds", "Remote Pricing Timeout")
-        return {}
-    except Exception as e:
-        # Truncate exception message to prevent character length errors
-        error_msg = str(e)[:300]
-        frappe.log_error(f"Remote pricing fetch failed: {error_msg}", "Remote Pricing Error")
-        return {}
+    # Chunk the codes so long lists neither overflow the URL nor get truncated by paging
+    item_codes = list(set(item_codes))
+    headers = {"Authorization": f"token {api_key}:{api_secret}"}
+    price_map = {}
+    
+    for i in range(0, len(item_codes), REMOTE_PRICE_CHUNK_SIZE):
+        rates, error = fetch_remote_price_chunk(remote_url, headers, item_codes[i:i + REMOTE_PRICE_CHUNK_SIZE])
+        if error:
+            frappe.log_error(error, "Remote Pricing Fetch Error")
+            continue
+        price_map.update(rates)
+    
+    return price_map
 
 
 @frappe.whitelist()
@@ -961,17 +946,9 @@ def get_cost_impact_analysis(period="30d", end_date=None):
                 pricing_item_code = 'F' + cleaned[1:]
                 pricing_item_codes.add(pricing_item_code)
     
-    # Configure remote site credentials from Settings
-    try:
-        settings = frappe.get_single("Rejection Analysis Settings")
-        remote_url = settings.sales_site_url or ""
-        api_key = settings.sales_site_api_key or ""
-        api_secret = settings.get_password("sales_site_api_secret") or ""
-    except Exception:
-        # Fallback to site_config if settings not configured
-        remote_url = frappe.conf.get("sales_site_url") or ""
-        api_key = frappe.conf.get("sales_site_api_key") or ""
-        api_secret = frappe.conf.get("sales_site_api_secret") or ""
+    # Configure remote site credentials from Settings (falls back to site_config; cached)
+    from rejection_analysis.rejection_analysis.cost_analysis_api import get_remote_pricing_config
+    remote_url, api_key, api_secret = get_remote_pricing_config()
     
     # Fetch all pricing data in one batch API call
     pricing_map = {}
@@ -1211,21 +1188,20 @@ def get_lot_inspection_report(filters=None):
     # STEP 2.5: Build WHERE clause using ONLY Work Planning lots
     if work_plan_lot_numbers:
         # Use ONLY Work Planning lot numbers (fast!)
-        lot_list_str = "'" + "','".join(work_plan_lot_numbers) + "'"
-        query += f"""
+        query += """
             WHERE ie.inspection_type = 'Lot Inspection'
             AND ie.docstatus = 1
-            AND ie.lot_no IN ({lot_list_str})
+            AND ie.lot_no IN %s
         """
-        params = []
+        params = [tuple(work_plan_lot_numbers)]
     else:
         # No Work Planning - fallback to empty result or moulding_date
         query += f"""
             WHERE ie.inspection_type = 'Lot Inspection'
             AND ie.docstatus = 1
-            AND DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') {date_condition}
+            AND mpe.moulding_date >= %s AND mpe.moulding_date < DATE_ADD(%s, INTERVAL 1 DAY)
         """
-        params = list(date_params)
+        params = [date_params[0], date_params[-1]]
     
     # STEP 3: Apply additional filters dynamically
     conditions = []
@@ -2319,8 +2295,10 @@ def generate_comprehensive_daily_report(date=None, threshold_percentage=5.0):
     threshold_percentage = flt(threshold_percentage)
     
     try:
-        # Check if report already exists for this date
-        existing = frappe.db.exists("Daily Rejection Report", {"report_date": date})
+        # Check if report already exists for this date. This only spares building a
+        # report that would be rejected; uq_drr_active_report_date enforces uniqueness on insert
+        # Cancelled reports are left out, matching the key
+        existing = frappe.db.exists("Daily Rejection Report", {"report_date": date, "docstatus": ["<", 2]})
         if existing:
             return {
                 "status": "exists",
@@ -2334,39 +2312,50 @@ def generate_comprehensive_daily_report(date=None, threshold_percentage=5.0):
         incoming_items = get_incoming_inspection_report({"date": date}) or []
         final_items = get_final_inspection_report({"date": date}) or []
         
-        # Calculate lot inspection metrics
+        # Calculate the summary metrics with one pass over each stage's rows
+        # Lot inspection metrics
         lot_total = len(lot_items)
-        lot_exceeding = sum(1 for item in lot_items if item.get("exceeds_threshold"))
-        lot_avg_rejection = 0
-        lot_patrol_avg = 0
-        lot_line_avg = 0
-        
-        if lot_total > 0:
-            lot_avg_rejection = sum(flt(item.get("lot_rej_pct", 0)) for item in lot_items) / lot_total
-            lot_patrol_avg = sum(flt(item.get("patrol_rej_pct", 0)) for item in lot_items) / lot_total
-            lot_line_avg = sum(flt(item.get("line_rej_pct", 0)) for item in lot_items) / lot_total
-        
-        # Calculate incoming inspection metrics
+        lot_exceeding = 0
+        lot_rej_sum = lot_patrol_sum = lot_line_sum = 0.0
+        for item in lot_items:
+            if item.get("exceeds_threshold"):
+                lot_exceeding += 1
+            lot_rej_sum += flt(item.get("lot_rej_pct", 0))
+            lot_patrol_sum += flt(item.get("patrol_rej_pct", 0))
+            lot_line_sum += flt(item.get("line_rej_pct", 0))
+        
+        lot_avg_rejection = lot_rej_sum / lot_total if lot_total else 0
+        lot_patrol_avg = lot_patrol_sum / lot_total if lot_total else 0
+        lot_line_avg = lot_line_sum / lot_total if lot_total else 0
+        
+        # Incoming inspection metrics
         incoming_total = len(incoming_items)
-        incoming_exceeding = sum(1 for item in incoming_items if flt(item.get("rej_pct", 0)) > threshold_percentage)
-        incoming_avg_rejection = 0
+        incoming_exceeding = 0
+        incoming_rej_sum = 0.0
+        for item in incoming_items:
+            rej_pct = flt(item.get("rej_pct", 0))
+            if rej_pct > threshold_percentage:
+                incoming_exceeding += 1
+            incoming_rej_sum += rej_pct
         
-        if incoming_total > 0:
-            incoming_avg_rejection = sum(flt(item.get("rej_pct", 0)) for item in incoming_items) / incoming_total
+        incoming_avg_rejection = incoming_rej_sum / incoming_total if incoming_total else 0
         
-        # Calculate final inspection metrics
+        # Final inspection metrics
         final_total = len(final_items)
-        final_exceeding = sum(1 for item in final_items if item.get("exceeds_threshold"))
-        final_avg_rejection = 0
-        final_patrol_avg = 0
-        final_line_avg = 0
-        final_lot_avg = 0
-        
-        if final_total > 0:
-            final_avg_rejection = sum(flt(item.get("final_insp_rej_pct", 0)) for item in final_items) / final_total
-            final_patrol_avg = sum(flt(item.get("patrol_rej_pct", 0)) for item in final_items) / final_total
-            final_line_avg = sum(flt(item.get("line_rej_pct", 0)) for item in final_items) / final_total
-            final_lot_avg = sum(flt(item.get("lot_rej_pct", 0)) for item in final_items) / final_total
+        final_exceeding = 0
+        final_rej_sum = final_patrol_sum = final_line_sum = final_lot_sum = 0.0
+        for item in final_items:
+            if item.get("exceeds_threshold"):
+                final_exceeding += 1
+            final_rej_sum += flt(item.get("final_insp_rej_pct", 0))
+            final_patrol_sum += flt(item.get("patrol_rej_pct", 0))
+            final_line_sum += flt(item.get("line_rej_pct", 0))
+            final_lot_sum += flt(item.get("lot_rej_pct", 0))
+        
+        final_avg_rejection = final_rej_sum / final_total if final_total else 0
+        final_patrol_avg = final_patrol_sum / final_total if final_total else 0
+        final_line_avg = final_line_sum / final_total if final_total else 0
+        final_lot_avg = final_lot_sum / final_total if final_total else 0
         
         # Create the Daily Rejection Report document
         report = frappe.get_doc({
@@ -2471,7 +2460,18 @@ def generate_comprehensive_daily_report(date=None, threshold_percentage=5.0):
             ]
         })
         
-        report.insert(ignore_permissions=True)
+        try:
+            report.insert(ignore_permissions=True)
+        except frappe.UniqueValidationError:
+            # A concurrent call created the report for this date after the check above
+            frappe.db.rollback()
+            frappe.clear_messages()
+            return {
+                "status": "exists",
+                "name": frappe.db.get_value("Daily Rejection Report", {"report_date": date, "docstatus": ["<", 2]}),
+                "message": f"Report already exists for {date}"
+            }
+        
         frappe.db.commit()
         
         return {
@@ -2866,7 +2866,7 @@ def get_defect_distribution_chart(days=30):
         LIMIT 10
     """, (days,), as_dict=True)
     
-    total_rejected = sum([flt(d.get("total_rejected_qty", 0)) for d in data])
+    total_rejected = sum(flt(d.get("total_rejected_qty", 0)) for d in data)
     results = []
     for row in data:
         rejected_qty = flt(row.get("total_rejected_qty", 0))
@@ -3258,9 +3258,7 @@ def get_drill_down_rejection_data(filters=None):
         filters['to_date'] = nowdate()
     
     try:
-        data = _get_unified_rejection_data(filters)
-        processed_data = _process_sublot_data(data)
-        return processed_data
+        return _get_unified_rejection_data(filters, with_quality_status=True)
     except Exception as e:
         frappe.log_error(f"Drill Down Report Error: {str(e)}", "Drill Down Report")
         frappe.throw(_("Error fetching report data: {0}").format(str(e)))
@@ -3282,16 +3280,24 @@ def get_drill_down_pivot_report(filters=None):
         filters['to_date'] = nowdate()
     
     try:
-        data = _get_unified_rejection_data(filters)
-        pivot_data = _get_product_grouped_pivot_data(data)
+        # Stream rows from an unbuffered cursor straight into the aggregation
+        # so the full UNION result is never materialised in memory
+        with frappe.db.unbuffered_cursor():
+            data = _get_unified_rejection_data(filters, as_iterator=True)
+            pivot_data = _get_product_grouped_pivot_data(data)
         return pivot_data
     except Exception as e:
         frappe.log_error(f"Drill Down Pivot Error: {str(e)}", "Drill Down Pivot")
         frappe.throw(_("Error fetching pivot data: {0}").format(str(e)))
 
-def _get_unified_rejection_data(filters):
+def _get_unified_rejection_data(filters, as_iterator=False, with_quality_status=False):
     """
     Unified fetch from SPP and Inspection Entry
+    
+    With as_iterator=True rows are yielded one at a time; callers must
+    consume them inside frappe.db.unbuffered_cursor().
+    With with_quality_status=True each row also carries rejection_percentage
+    and quality_status computed by the database.
     """
     conditions = _build_report_filter_conditions(filters)
     
@@ -3306,12 +3312,12 @@ def _get_unified_rejection_data(filters):
         spp.inspector_code,
         spp.total_inspected_qty_nos as inspected_qty,
         COALESCE(SUM(fv.rejected_qty), 0) as rejected_qty,
-        CASE WHEN spp.lot_no LIKE '%%-%%' THEN SUBSTRING_INDEX(spp.lot_no, '-', -1) ELSE '1' END as sublot_number,
-        CASE WHEN spp.lot_no LIKE '%%-%%' THEN SUBSTRING_INDEX(spp.lot_no, '-', 1) ELSE spp.lot_no END as main_lot,
+        spp.sublot_number_g as sublot_number,
+        spp.main_lot_g as main_lot,
         GROUP_CONCAT(CONCAT(fv.type_of_defect, ':', fv.rejected_qty) SEPARATOR '; ') as defect_details,
         COALESCE(finalitem.fvi_rejection_cost, 0) as rejection_cost
     FROM `tabSPP Inspection Entry` spp
-    LEFT JOIN `tabFV Inspection Entry Item` fv ON fv.parent = spp.name
+    LEFT JOIN `tabFV Inspection Entry Item` fv ON fv.parent = spp.name AND fv.rejected_qty > 0
     LEFT JOIN `tabFinal Inspection Report Item` finalitem ON finalitem.spp_inspection_entry = spp.name
     WHERE spp.docstatus != 2 {spp_cond}
     GROUP BY spp.name
@@ -3328,28 +3334,38 @@ def _get_unified_rejection_data(filters):
         ie.inspector_code,
         COALESCE(ie.inspected_qty_nos, ie.total_inspected_qty_nos, 0) as inspected_qty,
         COALESCE(SUM(iei.rejected_qty), 0) as rejected_qty,
-        CASE 
-            WHEN ie.lot_no LIKE '%%-%%' THEN SUBSTRING_INDEX(ie.lot_no, '-', -1) 
-            WHEN ie.lot_no LIKE '%%/%%' THEN SUBSTRING_INDEX(ie.lot_no, '/', -1)
-            ELSE '1' 
-        END as sublot_number,
-        CASE 
-            WHEN ie.lot_no LIKE '%%-%%' THEN SUBSTRING_INDEX(ie.lot_no, '-', 1)
-            WHEN ie.lot_no LIKE '%%/%%' THEN SUBSTRING_INDEX(ie.lot_no, '/', 1)
-            ELSE ie.lot_no 
-        END as main_lot,
+        ie.sublot_number_g as sublot_number,
+        ie.main_lot_g as main_lot,
         GROUP_CONCAT(CONCAT(iei.type_of_defect, ':', iei.rejected_qty) SEPARATOR '; ') as defect_details,
         COALESCE(lotitem.total_rejection_cost, incitem.rejection_cost, 0) as rejection_cost
     FROM `tabInspection Entry` ie
-    LEFT JOIN `tabInspection Entry Item` iei ON iei.parent = ie.name
+    LEFT JOIN `tabInspection Entry Item` iei ON iei.parent = ie.name AND iei.rejected_qty > 0
     LEFT JOIN `tabLot Inspection Report Item` lotitem ON lotitem.inspection_entry = ie.name
     LEFT JOIN `tabIncoming Inspection Report Item` incitem ON incitem.inspection_entry = ie.name
     WHERE ie.docstatus != 2 {ie_cond}
     GROUP BY ie.name
     """.format(ie_cond=conditions['ie'])
     
-    union_query = f"{spp_query} UNION ALL {ie_query} ORDER BY posting_date DESC"
-    return frappe.db.sql(union_query, filters, as_dict=True)
+    if with_quality_status:
+        union_query = f"""
+        SELECT r.*,
+            CASE
+                WHEN r.rejection_percentage = 0 THEN 'Perfect'
+                WHEN r.rejection_percentage <= 2 THEN 'Excellent'
+                WHEN r.rejection_percentage <= 5 THEN 'Good'
+                WHEN r.rejection_percentage <= 10 THEN 'Warning'
+                ELSE 'Critical'
+            END as quality_status
+        FROM (
+            SELECT unified.*,
+                ROUND(IF(unified.inspected_qty > 0, unified.rejected_qty / unified.inspected_qty * 100, 0), 2) as rejection_percentage
+            FROM ({spp_query} UNION ALL {ie_query}) unified
+        ) r
+        ORDER BY r.posting_date DESC
+        """
+    else:
+        union_query = f"{spp_query} UNION ALL {ie_query} ORDER BY posting_date DESC"
+    return frappe.db.sql(union_query, filters, as_dict=True, as_iterator=as_iterator)
 
 def _build_report_filter_conditions(filters):
     spp_cond = ""
@@ -3376,63 +3392,61 @@ def _build_report_filter_conditions(filters):
             
     return {'spp': spp_cond, 'ie': ie_cond}
 
-def _process_sublot_data(data):
-    processed = []
-    for row in data:
-        inspected = flt(row.get('inspected_qty', 0))
-        rejected = flt(row.get('rejected_qty', 0))
-        row['rejection_percentage'] = round((rejected / inspected * 100), 2) if inspected > 0 else 0
-        row['quality_status'] = _get_quality_status(row['rejection_percentage'])
-        processed.append(row)
-    return processed
-
-def _get_quality_status(percentage):
-    if percentage == 0: return 'Perfect'
-    if percentage <= 2: return 'Excellent'
-    if percentage <= 5: return 'Good'
-    if percentage <= 10: return 'Warning'
-    return 'Critical'
+def _new_product_group():
+    return {'total_inspected': 0, 'total_rejected': 0, 'total_cost': 0, 'main_lots': defaultdict(_new_main_lot_group), 'defects': defaultdict(float)}
+
+def _new_main_lot_group():
+    return {'total_inspected': 0, 'total_rejected': 0, 'total_cost': 0, 'sublots': {}, 'defects': defaultdict(float)}
+
+_PIVOT_ROW_FIELDS = itemgetter(
+    'item_code', 'main_lot', 'sublot_number', 'lot_no', 'posting_date', 'inspector_code',
+    'inspection_type', 'document_name', 'source_type', 'inspected_qty', 'rejected_qty',
+    'rejection_cost', 'defect_details'
+)
 
 def _get_product_grouped_pivot_data(data):
-    product_groups = {}
+    product_groups = defaultdict(_new_product_group)
     all_normalized_defects = set()
     
+    # Hoist globals used in the hot loop to locals
+    pick = _PIVOT_ROW_FIELDS
+    _flt = flt
+    _normalize = normalize_defect_type
+    add_defect = all_normalized_defects.add
+    
     for row in data:
-        product = row.get('item_code') or 'Unknown'
-        main_lot = row.get('main_lot') or 'Unknown'
-        sublot = str(row.get('sublot_number', '1'))
+        (item_code, main_lot, sublot, lot_no, posting_date, inspector_code, inspection_type,
+            document_name, source_type, qty_inspected, qty_rejected, cost, defect_details) = pick(row)
         
-        if product not in product_groups:
-            product_groups[product] = {'total_inspected': 0, 'total_rejected': 0, 'total_cost': 0, 'main_lots': {}, 'defects': {}}
+        product = item_code or 'Unknown'
+        main_lot = main_lot or 'Unknown'
         
         p_group = product_groups[product]
-        if main_lot not in p_group['main_lots']:
-            p_group['main_lots'][main_lot] = {'total_inspected': 0, 'total_rejected': 0, 'total_cost': 0, 'sublots': {}, 'defects': {}}
-            
         m_group = p_group['main_lots'][main_lot]
+        sublots = m_group['sublots']
         sublot_key = f"{main_lot}_{sublot}"
-        if sublot_key not in m_group['sublots']:
-            m_group['sublots'][sublot_key] = {
-                'lot_no': row.get('lot_no'),
+        s_data = sublots.get(sublot_key)
+        if s_data is None:
+            s_data = sublots[sublot_key] = {
+                'lot_no': lot_no,
                 'inspected_qty': 0,
                 'rejected_qty': 0,
                 'rejection_cost': 0,
-                'defects': {},
-                'posting_date': row.get('posting_date'),
-                'inspector_code': row.get('inspector_code'),
-                'inspection_type': row.get('inspection_type'),
-                'document_name': row.get('document_name'),
-                'source_type': row.get('source_type')
+                'defects': defaultdict(float),
+                'posting_date': posting_date,
+                'inspector_code': inspector_code,
+                'inspection_type': inspection_type,
+                'document_name': document_name,
+                'source_type': source_type
             }
-            
-        s_data = m_group['sublots'][sublot_key]
-        qty_inspected = flt(row.get('inspected_qty', 0))
-        qty_rejected = flt(row.get('rejected_qty', 0))
+        
+        qty_inspected = _flt(qty_inspected)
+        qty_rejected = _flt(qty_rejected)
         
         s_data['inspected_qty'] += qty_inspected
         s_data['rejected_qty'] += qty_rejected
         
-        cost = flt(row.get('rejection_cost', 0))
+        cost = _flt(cost)
         s_data['rejection_cost'] += cost
         m_group['total_cost'] += cost
         p_group['total_cost'] += cost
@@ -3442,29 +3456,33 @@ def _get_product_grouped_pivot_data(data):
         p_group['total_inspected'] += qty_inspected
         p_group['total_rejected'] += qty_rejected
         
-        # Process Defects
-        defect_details = row.get('defect_details')
-        if defect_details:
+        # Process Defects (rows without rejected child items carry no details)
+        if defect_details and defect_details != ':0':
+            s_defects = s_data['defects']
+            m_defects = m_group['defects']
+            p_defects = p_group['defects']
             for pair in defect_details.split('; '):
                 if ':' in pair:
-                    d_type, d_qty = pair.split(':', 1)
-                    try:
-                        val = flt(d_qty)
-                        norm = normalize_defect_type(d_type)
-                        all_normalized_defects.add(norm)
-                        
-                        s_data['defects'][norm] = s_data['defects'].get(norm, 0) + val
-                        m_group['defects'][norm] = m_group['defects'].get(norm, 0) + val
-                        p_group['defects'][norm] = p_group['defects'].get(norm, 0) + val
-                    except: continue
+                    d_type, d_qty = pair.rsplit(':', 1)
+                    if not d_qty or d_qty == '0':
+                        continue
+                    # Quantities come from CONCAT of the numeric rejected_qty column
+                    val = float(d_qty)
+                    norm = _normalize(d_type)
+                    add_defect(norm)
+                    
+                    s_defects[norm] += val
+                    m_defects[norm] += val
+                    p_defects[norm] += val
 
     # Flatten for tree structure
     rows = []
     sorted_defects = sorted(list(all_normalized_defects))
     
     for product, p_data in product_groups.items():
+        p_id = f"p_{product}"
         p_row = {
-            'id': f"p_{product}",
+            'id': p_id,
             'type': 'product',
             'product_code': product,
             'main_lot': '',
@@ -3478,10 +3496,12 @@ def _get_product_grouped_pivot_data(data):
         }
         rows.append(p_row)
         
+        sl_prefix = f"sl_{product}_"
         for ml, ml_data in p_data['main_lots'].items():
+            ml_id = f"ml_{product}_{ml}"
             ml_row = {
-                'id': f"ml_{product}_{ml}",
-                'parentId': f"p_{product}",
+                'id': ml_id,
+                'parentId': p_id,
                 'type': 'main_lot',
                 'product_code': product,
                 'main_lot': ml,
@@ -3497,8 +3517,8 @@ def _get_product_grouped_pivot_data(data):
             
             for sl_id, sl_data in ml_data['sublots'].items():
                 sl_row = {
-                    'id': f"sl_{product}_{sl_id}",
-                    'parentId': f"ml_{product}_{ml}",
+                    'id': sl_prefix + sl_id,
+                    'parentId': ml_id,
                     'type': 'sublot',
                     'product_code': product,
                     'main_lot': ml,
@@ -6,37 +6,102 @@ All 4 stages: Moulding, Lot Rejection, Incoming Inspection, FVI
 import frappe
 from frappe import _
 from frappe.utils import flt, today, add_days, add_months, getdate
+from frappe.utils.password import get_decrypted_password
 import requests
 import json
+import hashlib
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+
+ITEM_PRICE_CACHE_KEY = "cost_analysis_item_price"
+REMOTE_PRICE_CACHE_KEY = "cost_analysis_remote_price"
+REMOTE_PRICE_MISS_CACHE_KEY = "cost_analysis_remote_price_miss"
+REMOTE_PRICE_CACHE_TTL = 900
+REMOTE_PRICE_CHUNK_SIZE = 50
+REMOTE_PRICE_SNAPSHOT_TTL = 7200
+REMOTE_PRICE_SYNC_PAGE_SIZE = 500
+WORK_PLANNING_LOTS_CACHE_KEY = "cost_analysis_wp_lots"
+COST_ANALYSIS_CACHE_KEY = "cost_analysis_payload"
+STAGE_ROWS_CACHE_KEY = "cost_analysis_stage_rows"
+STAGE_ROWS_CACHE_TTL = 60
+PRICING_CONFIG_CACHE_KEY = "cost_analysis_pricing_config"
+PRICING_CONFIG_CACHE_TTL = 300
+
+# Shared keep-alive session for remote pricing calls; retries transient gateway errors
+pricing_session = requests.Session()
+_pricing_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), raise_on_status=False)
+)
+pricing_session.mount("https://", _pricing_adapter)
+pricing_session.mount("http://", _pricing_adapter)
+
+# Start of the reporting window for each period, ending on the selected date
+PERIOD_FROM_DATE = {
+    "daily": lambda d: d,
+    "weekly": lambda d: add_days(d, -6),
+    "monthly": lambda d: d.replace(day=1),
+    "6months": lambda d: add_months(d, -6),
+}
 
 
 def get_remote_pricing_config():
     """Get remote pricing configuration from Settings or site_config"""
-    try:
-        settings = frappe.get_single("Rejection Analysis Settings")
-        remote_url = settings.sales_site_url or ""
-        api_key = settings.sales_site_api_key or ""
-        api_secret = settings.get_password("sales_site_api_secret") or ""
-    except Exception:
-        remote_url = frappe.conf.get("sales_site_url") or ""
-        api_key = frappe.conf.get("sales_site_api_key") or ""
+    # Only the URL and key are cached; the secret stays encrypted in the
+    # database and is decrypted on every call, never written to Redis
+    cached = frappe.cache().get_value(PRICING_CONFIG_CACHE_KEY)
+    if cached is None:
+        try:
+            settings = frappe.get_single("Rejection Analysis Settings")
+            # A set Password field reads back masked; unset means site_config is used instead
+            from_settings = bool(settings.sales_site_api_secret)
+        except Exception:
+            from_settings = False
+        
+        if from_settings:
+            cached = [settings.sales_site_url or "", settings.sales_site_api_key or "", True]
+        else:
+            cached = [frappe.conf.get("sales_site_url") or "", frappe.conf.get("sales_site_api_key") or "", False]
+        
+        frappe.cache().set_value(PRICING_CONFIG_CACHE_KEY, cached, expires_in_sec=PRICING_CONFIG_CACHE_TTL)
+    
+    remote_url, api_key, from_settings = cached
+    
+    if from_settings:
+        api_secret = get_decrypted_password(
+            "Rejection Analysis Settings", "Rejection Analysis Settings",
+            "sales_site_api_secret", raise_exception=False
+        ) or ""
+    else:
         api_secret = frappe.conf.get("sales_site_api_secret") or ""
     
     return remote_url, api_key, api_secret
 
 
+def clear_pricing_config_cache(doc=None, method=None):
+    """Drop the cached remote pricing config when Rejection Analysis Settings is saved"""
+    frappe.cache().delete_value(PRICING_CONFIG_CACHE_KEY)
+
+
+@lru_cache(maxsize=8192)
 def convert_to_finished_product_code(material_item_code):
     """
     Convert item code for remote pricing lookup
     - T-codes: Convert T2438 → F2438 (Material to Finished)
     - P-codes: Keep as P6117 (Product codes used as-is)
     - F-codes: Keep as F2438 (Finished codes used as-is)
+    
+    Pure string mapping, memoised since the same item codes recur across requests.
     """
     if not material_item_code:
         return None
     
     # Clean up item code
-    cleaned = material_item_code.strip().replace('t.', '').replace('T.', '').split()[0].upper()
+    cleaned = material_item_code.strip().replace('t.', '').replace('T.', '').split(None, 1)[0].upper()
     
     # Convert T-codes (Material) and P-codes (Product) to F-codes (Finished)
     # Remote pricing is available for F-codes
@@ -51,67 +116,273 @@ def fetch_remote_item_prices(item_codes):
     """
     Fetch item prices from remote Sales site
     
+    Rates are memoised per item in the Redis hash REMOTE_PRICE_CACHE_KEY,
+    and items the remote site has no price for in REMOTE_PRICE_MISS_CACHE_KEY.
+    Both expire as a whole every REMOTE_PRICE_CACHE_TTL seconds (the price
+    hash is replaced hourly instead once sync_remote_item_prices runs), so
+    only codes not seen in that window are requested from the remote site.
+    
     Args:
         item_codes: List of Finished Product item codes (F-prefix)
     
     Returns:
         dict: Mapping of item_code → price_list_rate
     """
-    if not item_codes:
+    if not item_codes or not any(item_codes):
         return {}
     
+    cache = frappe.cache()
+    price_map = {}
+    missing_codes = []
+    
+    for item_code in set(item_codes):
+        rate = cache.hget(REMOTE_PRICE_CACHE_KEY, item_code)
+        if rate is not None:
+            price_map[item_code] = rate
+        elif cache.hget(REMOTE_PRICE_MISS_CACHE_KEY, item_code) is None:
+            missing_codes.append(item_code)
+    
+    if not missing_codes:
+        return price_map
+    
     remote_url, api_key, api_secret = get_remote_pricing_config()
     
     if not (remote_url and api_key and api_secret):
-        return {}
+        return price_map
         
-    # Batch processing to avoid URL length limits
-    item_codes = list(set(item_codes))
-    chunk_size = 50
-    price_map = {}
+    # Batch processing to avoid URL length limits; chunks are fetched in parallel
+    chunks = [
+        missing_codes[i:i + REMOTE_PRICE_CHUNK_SIZE]
+        for i in range(0, len(missing_codes), REMOTE_PRICE_CHUNK_SIZE)
+    ]
+    headers = {"Authorization": f"token {api_key}:{api_secret}"}
+    
+    with ThreadPoolExecutor(max_workers=min(4, len(chunks))) as executor:
+        results = list(executor.map(
+            lambda chunk: fetch_remote_price_chunk(remote_url, headers, chunk), chunks
+        ))
+    
+    for chunk, (rates, error) in zip(chunks, results):
+        if error:
+            frappe.log_error(error, "Cost Analysis Batch Error")
+            continue
+        
+        price_map.update(rates)
+        
+        # Only successful batches are cached, so failures are retried next call.
+        # Misses go to their own short-lived hash so they never outlive the TTL as zero prices
+        for item_code in chunk:
+            if item_code in rates:
+                cache.hset(REMOTE_PRICE_CACHE_KEY, item_code, rates[item_code])
+            else:
+                cache.hset(REMOTE_PRICE_MISS_CACHE_KEY, item_code, 1)
     
-    for i in range(0, len(item_codes), chunk_size):
-        chunk = item_codes[i:i + chunk_size]
-        try:
-            filters = [
-                ["item_code", "in", chunk],
-                ["price_list", "=", "Standard Selling"]
-            ]
-            fields = ["item_code", "price_list_rate"]
-            
-            response = requests.get(
+    # Expire each hash as a whole; set the TTL only when it is first populated
+    for key in (REMOTE_PRICE_CACHE_KEY, REMOTE_PRICE_MISS_CACHE_KEY):
+        cache_key = cache.make_key(key)
+        if cache.ttl(cache_key) == -1:
+            cache.expire(cache_key, REMOTE_PRICE_CACHE_TTL)
+    
+    return price_map
+
+
+def fetch_remote_price_chunk(remote_url, headers, chunk):
+    """
+    Fetch Standard Selling rates for one chunk of item codes
+    
+    Safe to run in a worker thread: it only makes the HTTP call and
+    returns (rates, error) rather than logging or caching itself.
+    
+    Returns:
+        tuple: (dict of item_code → rate or None, error message or None)
+    """
+    filters = [
+        ["item_code", "in", chunk],
+        ["price_list", "=", "Standard Selling"]
+    ]
+    fields = ["item_code", "price_list_rate"]
+    
+    try:
+        response = pricing_session.get(
+            f"{remote_url}/api/resource/Item Price",
+            params={
+                "filters": json.dumps(filters),
+                "fields": json.dumps(fields),
+                # 0 = no page limit, so items with several price rows are not truncated
+                "limit_page_length": 0
+            },
+            headers=headers,
+            timeout=10
+        )
+        
+        if response.status_code != 200:
+            return None, f"Remote pricing batch failed {response.status_code}: {response.text[:500]}"
+        
+        return parse_remote_price_rows(response.json().get("data", ())), None
+        
+    except Exception as e:
+        return None, f"Remote pricing batch error: {str(e)[:300]}"
+
+
+def parse_remote_price_rows(item_prices):
+    """Map item_code → rate for remote Item Price rows, skipping blank codes and non-positive rates"""
+    _flt = flt
+    return {
+        ip["item_code"]: rate
+        for ip in item_prices
+        if ip.get("item_code") and (rate := _flt(ip.get("price_list_rate", 0))) > 0
+    }
+
+
+def sync_remote_item_prices():
+    """
+    Snapshot the remote Standard Selling price list into the remote price cache
+    
+    Runs hourly from scheduler_events so dashboard requests find every
+    remotely priced item already cached, keeping the Sales site off the
+    request path. Items missing from the snapshot still fall back to
+    fetch_remote_item_prices.
+    
+    The price list is read in pages of REMOTE_PRICE_SYNC_PAGE_SIZE into a
+    staging hash, which then replaces REMOTE_PRICE_CACHE_KEY in one RENAME.
+    Prices deleted or changed remotely therefore drop out on the next run,
+    and a failed run leaves the previous snapshot in place.
+    """
+    remote_url, api_key, api_secret = get_remote_pricing_config()
+    
+    if not (remote_url and api_key and api_secret):
+        return
+    
+    cache = frappe.cache()
+    staging_key = f"{REMOTE_PRICE_CACHE_KEY}_sync"
+    cache.delete_value(staging_key)
+    
+    try:
+        limit_start = 0
+        while True:
+            response = pricing_session.get(
                 f"{remote_url}/api/resource/Item Price",
                 params={
-                    "filters": json.dumps(filters),
-                    "fields": json.dumps(fields),
-                    "limit_page_length": chunk_size
-                },
-                headers={
-                    "Authorization": f"token {api_key}:{api_secret}"
+                    "filters": json.dumps([["price_list", "=", "Standard Selling"]]),
+                    "fields": json.dumps(["item_code", "price_list_rate"]),
+                    # Stable order so pages neither overlap nor skip rows
+                    "order_by": "name asc",
+                    "limit_start": limit_start,
+                    "limit_page_length": REMOTE_PRICE_SYNC_PAGE_SIZE
                 },
-                timeout=10
+                headers={"Authorization": f"token {api_key}:{api_secret}"},
+                timeout=30
             )
             
-            if response.status_code == 200:
-                data = response.json()
-                for item_price in data.get("data", []):
-                    item_code = item_price.get("item_code")
-                    rate = flt(item_price.get("price_list_rate", 0))
-                    if item_code and rate > 0:
-                        price_map[item_code] = rate
-            else:
-                 frappe.log_error(
-                    f"Remote pricing batch failed {response.status_code}", 
-                    "Cost Analysis Batch Error"
+            if response.status_code != 200:
+                frappe.log_error(
+                    f"Remote price sync failed {response.status_code}: {response.text[:500]}",
+                    "Cost Analysis Price Sync Error"
                 )
-                
-        except Exception as e:
-            frappe.log_error(f"Remote pricing batch error: {str(e)}", "Cost Analysis Batch Exception")
-            continue
+                cache.delete_value(staging_key)
+                return
+            
+            rows = response.json().get("data", ())
+            for item_code, rate in parse_remote_price_rows(rows).items():
+                cache.hset(staging_key, item_code, rate)
             
+            if len(rows) < REMOTE_PRICE_SYNC_PAGE_SIZE:
+                break
+            limit_start += REMOTE_PRICE_SYNC_PAGE_SIZE
+        
+        price_cache_key = cache.make_key(REMOTE_PRICE_CACHE_KEY)
+        staging_cache_key = cache.make_key(staging_key)
+        
+        if cache.exists(staging_cache_key):
+            cache.rename(staging_cache_key, price_cache_key)
+            # Lapses if the scheduler stops, instead of serving the last snapshot forever
+            cache.expire(price_cache_key, REMOTE_PRICE_SNAPSHOT_TTL)
+        else:
+            # Remote price list is empty
+            cache.delete_value(REMOTE_PRICE_CACHE_KEY)
+        
+        # Items priced since their last miss are picked up from the new snapshot
+        cache.delete_value(REMOTE_PRICE_MISS_CACHE_KEY)
+        
+    except Exception as e:
+        cache.delete_value(staging_key)
+        frappe.log_error(f"Remote price sync error: {str(e)[:300]}", "Cost Analysis Price Sync Error")
+
+
+def get_local_item_prices(item_codes):
+    """
+    Get Standard Selling rates from the local Item Price list
+    
+    Rates are served from the Redis hash ITEM_PRICE_CACHE_KEY; only codes
+    not yet cached are read from the database. Entries are dropped by
+    clear_item_price_cache when an Item Price changes.
+    
+    Args:
+        item_codes: List of Material item codes
+    
+    Returns:
+        dict: Mapping of item_code → price_list_rate
+    """
+    if not item_codes or not any(item_codes):
+        return {}
+    
+    cache = frappe.cache()
+    price_map = {}
+    missing_codes = []
+    
+    for item_code in set(item_codes):
+        rate = cache.hget(ITEM_PRICE_CACHE_KEY, item_code)
+        if rate is None:
+            missing_codes.append(item_code)
+        else:
+            price_map[item_code] = rate
+    
+    if missing_codes:
+        # Ordered by modified so the most recently updated price wins
+        prices = dict(frappe.get_all(
+            "Item Price",
+            filters={"price_list": "Standard Selling", "item_code": ["in", missing_codes]},
+            fields=["item_code", "price_list_rate"],
+            order_by="modified asc",
+            as_list=True
+        ))
+        
+        # Cache misses as 0 too so unpriced items don't hit the DB every call
+        for item_code in missing_codes:
+            rate = flt(prices.get(item_code))
+            cache.hset(ITEM_PRICE_CACHE_KEY, item_code, rate)
+            price_map[item_code] = rate
+    
     return price_map
 
 
+def resolve_item_rates(t_to_f_map, pricing_map, local_prices):
+    """
+    Resolve the effective rate for each Material item code
+    
+    Uses the remote price of the Finished Product code, falling back to the
+    local Standard Selling rate when the remote price is 0 or missing.
+    
+    Returns:
+        dict: Mapping of Material item_code → rate
+    """
+    item_rates = {}
+    for material_code, finished_code in t_to_f_map.items():
+        rate = pricing_map.get(finished_code, 0)
+        if rate == 0:
+            rate = flt(local_prices.get(material_code))
+        item_rates[material_code] = rate
+    
+    return item_rates
+
+
+def clear_item_price_cache(doc, method=None):
+    """Drop the cached local rate when an Item Price is saved or deleted (doc_events hook)"""
+    if doc.item_code:
+        frappe.cache().hdel(ITEM_PRICE_CACHE_KEY, doc.item_code)
+    clear_cost_analysis_cache(doc, method)
+
+
 @frappe.whitelist()
 def get_cost_analysis_data(filters=None):
     """
@@ -140,9 +411,18 @@ def get_cost_analysis_data(filters=None):
     selected_date = getdate(filters.get("date", today()))
     from_date, to_date = get_date_range(period, selected_date)
     
+    # Repeat hits for the same period and date are served from Redis
+    cache_key = f"{COST_ANALYSIS_CACHE_KEY}:{period}:{selected_date}"
+    cached = frappe.cache().get_value(cache_key)
+    if cached is not None:
+        return cached
+    
     # Get lot numbers from Work Planning
     work_planning_lots = get_work_planning_lots(from_date, to_date)
-    lot_numbers = [lot['lot_number'] for lot in work_planning_lots]
+    
+    # Build the lot → plan map once; its keys double as the de-duplicated lot list
+    lot_plan_map = {lot['lot_number']: lot for lot in work_planning_lots}
+    lot_numbers = list(lot_plan_map)
     
     if not lot_numbers:
         return {
@@ -160,16 +440,28 @@ def get_cost_analysis_data(filters=None):
             "summary": get_empty_summary()
         }
     
-    # Fetch all stages
-    moulding_data = get_moulding_data(lot_numbers, work_planning_lots)
-    lot_rejection_data = get_lot_rejection_data(lot_numbers)
-    incoming_data = get_incoming_inspection_data(lot_numbers)
-    fvi_data = get_fvi_data(lot_numbers)
+    # Fetch all stages concurrently - they are independent of each other
+    moulding_data, lot_rejection_data, incoming_data, fvi_data = run_stages_concurrently([
+        (fetch_stage_rows_cached, (fetch_moulding_rows, lot_numbers)),
+        (fetch_stage_rows_cached, (fetch_lot_rejection_rows, lot_numbers)),
+        (fetch_stage_rows_cached, (fetch_incoming_rows, lot_numbers)),
+        (fetch_stage_rows_cached, (fetch_fvi_rows, lot_numbers))
+    ])
+    
+    # Price the items of all four stages with a single remote fetch
+    item_rates = get_item_rates(moulding_data, lot_rejection_data, incoming_data, fvi_data)
+    
+    moulding_data, moulding_totals = apply_moulding_pricing(
+        moulding_data, lot_plan_map, item_rates, include_summary=True
+    )
+    apply_lot_rejection_pricing(lot_rejection_data, item_rates)
+    apply_incoming_pricing(incoming_data, item_rates)
+    apply_fvi_pricing(fvi_data, item_rates)
     
    # Calculate summary
-    summary = calculate_summary(moulding_data, lot_rejection_data, incoming_data, fvi_data)
+    summary = calculate_summary(moulding_totals, lot_rejection_data, incoming_data, fvi_data)
     
-    return {
+    result = {
         "success": True,
         "period": period,
         "from_date": str(from_date),
@@ -182,6 +474,10 @@ def get_cost_analysis_data(filters=None):
         },
         "summary": summary
     }
+    
+    frappe.cache().set_value(cache_key, result, expires_in_sec=300)
+    
+    return result
 
 
 @frappe.whitelist()
@@ -215,10 +511,8 @@ def get_production_data_phase1(filters=None):
             }
         }
     
-    production_data = get_mpe_with_rates(work_planning_lots)
-    
-    total_qty = sum([flt(row.get('production_qty_nos', 0)) for row in production_data])
-    total_value = sum([flt(row.get('production_value', 0)) for row in production_data])
+    # Totals come back from the pricing loop, so no extra passes over the rows
+    production_data, totals = get_mpe_with_rates(work_planning_lots, include_summary=True)
     
     return {
         "success": True,
@@ -229,34 +523,65 @@ def get_production_data_phase1(filters=None):
         "production_entries": len(production_data),
         "production_data": production_data,
         "summary": {
-            "total_lots": len(set([row['lot_no'] for row in production_data])),
-            "total_qty": total_qty,
-            "total_value": total_value
+            "total_lots": totals["distinct_lots"],
+            "total_qty": totals["total_qty"],
+            "total_value": totals["total_value"]
         }
     }
 
 
+def run_stages_concurrently(stage_calls):
+    """
+    Run independent stage fetches in parallel worker threads
+    
+    Each worker opens its own site connection since the request's
+    DB connection is not thread-safe.
+    
+    Args:
+        stage_calls: List of (function, args) tuples
+    
+    Returns:
+        list: Results in the same order as stage_calls
+    """
+    site = frappe.local.site
+    sites_path = frappe.local.sites_path
+    user = frappe.session.user
+    
+    with ThreadPoolExecutor(max_workers=len(stage_calls)) as executor:
+        futures = [
+            executor.submit(_run_stage_with_connection, site, sites_path, user, fn, args)
+            for fn, args in stage_calls
+        ]
+        return [future.result() for future in futures]
+
+
+def _run_stage_with_connection(site, sites_path, user, fn, args):
+    """Initialise a Frappe context for the worker thread and run a stage function"""
+    frappe.init(site=site, sites_path=sites_path)
+    try:
+        frappe.connect()
+        frappe.set_user(user)
+        return fn(*args)
+    finally:
+        frappe.destroy()
+
+
 def get_date_range(period, selected_date):
     """Calculate from_date and to_date based on period"""
     
-    if period == "daily":
-        return selected_date, selected_date
-    elif period == "weekly":
-        from_date = add_days(selected_date, -6)
-        return from_date, selected_date
-    elif period == "monthly":
-        from_date = selected_date.replace(day=1)
-        return from_date, selected_date
-    elif period == "6months":
-        from_date = add_months(selected_date, -6)
-        return from_date, selected_date
-    else:
-        return selected_date, selected_date
+    get_from_date = PERIOD_FROM_DATE.get(period, PERIOD_FROM_DATE["daily"])
+    return get_from_date(selected_date), selected_date
 
 
 def get_work_planning_lots(from_date, to_date):
     """Get lot numbers from Work Planning and Add On Work Planning"""
     
+    # Dashboards refresh the same period repeatedly, so serve recent results from Redis
+    cache_key = f"{WORK_PLANNING_LOTS_CACHE_KEY}:{from_date}:{to_date}"
+    cached = frappe.cache().get_value(cache_key)
+    if cached is not None:
+        return cached
+    
     query = """
         SELECT DISTINCT 
             wpi.lot_number, 
@@ -271,7 +596,9 @@ def get_work_planning_lots(from_date, to_date):
         AND wpi.lot_number IS NOT NULL
         AND wpi.lot_number != ''
         
-        UNION
+        -- The source literal differs per side, so the two halves can never
+        -- produce identical rows; UNION ALL skips the cross-side dedup sort
+        UNION ALL
         
         SELECT DISTINCT 
             awpi.lot_number, 
@@ -289,26 +616,107 @@ def get_work_planning_lots(from_date, to_date):
         ORDER BY planned_date DESC
     """
     
-    return frappe.db.sql(query, (from_date, to_date, from_date, to_date), as_dict=True)
+    work_planning_lots = frappe.db.sql(query, (from_date, to_date, from_date, to_date), as_dict=True)
+    frappe.cache().set_value(cache_key, work_planning_lots, expires_in_sec=60)
+    
+    return work_planning_lots
+
 
+def clear_work_planning_lots_cache(doc, method=None):
+    """Drop cached work planning lots when a plan is submitted or cancelled (doc_events hook)"""
+    frappe.cache().delete_keys(WORK_PLANNING_LOTS_CACHE_KEY)
+    clear_cost_analysis_cache(doc, method)
 
-def get_moulding_data(lot_numbers, work_planning_lots):
-    """Stage 1: Get Moulding Production Entry data with remote pricing"""
+
+def clear_cost_analysis_cache(doc, method=None):
+    """Drop cached cost analysis payloads when source entries change (doc_events hook)"""
+    frappe.cache().delete_keys(COST_ANALYSIS_CACHE_KEY)
+    frappe.cache().delete_keys(STAGE_ROWS_CACHE_KEY)
+
+
+def fetch_stage_rows_cached(fetch_fn, lot_numbers):
+    """
+    Run a stage fetcher, reusing its rows from Redis for STAGE_ROWS_CACHE_TTL seconds
     
+    Keyed by fetcher and lot set; the rows are pickled, so callers can
+    enrich the returned rows in place without touching the cached copy.
+    """
     if not lot_numbers:
         return []
     
-    lot_plan_map = {lot['lot_number']: lot for lot in work_planning_lots}
-    lot_numbers_str = "'" + "','".join(lot_numbers) + "'"
+    lots_hash = hashlib.sha1(",".join(sorted(lot_numbers)).encode()).hexdigest()
+    cache_key = f"{STAGE_ROWS_CACHE_KEY}:{fetch_fn.__name__}:{lots_hash}"
+    
+    # expires=True skips the request-local copy, so in-place enrichment can't leak into later reads
+    rows = frappe.cache().get_value(cache_key, expires=True)
+    if rows is None:
+        rows = fetch_fn(lot_numbers)
+        frappe.cache().set_value(cache_key, rows, expires_in_sec=STAGE_ROWS_CACHE_TTL)
+    
+    return rows
+
+
+def get_item_rates(*stage_rows):
+    """
+    Resolve the rate for every Material item code found in the given stage rows
+    
+    All codes are priced together with one remote fetch and one local
+    fallback query, however many stages are passed in.
+    
+    Args:
+        *stage_rows: One or more lists of stage rows carrying item_code
+    
+    Returns:
+        dict: Mapping of Material item_code → rate
+    """
+    # Sparse periods often leave every stage empty; skip the cache and remote lookups
+    if not any(stage_rows):
+        return {}
+    
+    # Collect unique Material item codes (T-prefix) and convert to Finished Product codes (F-prefix)
+    t_to_f_map = {}
+    for rows in stage_rows:
+        for row in rows:
+            material_code = row['item_code']
+            if material_code and material_code not in t_to_f_map:
+                t_to_f_map[material_code] = convert_to_finished_product_code(material_code)
+    
+    # Fetch remote pricing for Finished Product codes
+    pricing_map = fetch_remote_item_prices([code for code in t_to_f_map.values() if code])
     
-    # Fetch MPE data WITHOUT pricing (remove Item Price JOIN)
-    query = f"""
+    # Local Item Price fallback for items without a remote rate, in one query
+    local_prices = get_local_item_prices([
+        code for code, finished_code in t_to_f_map.items() if not pricing_map.get(finished_code)
+    ])
+    
+    return resolve_item_rates(t_to_f_map, pricing_map, local_prices)
+
+
+def get_moulding_data(lot_numbers, lot_plan_map, include_summary=False):
+    """
+    Stage 1: Get Moulding Production Entry data with remote pricing
+    
+    lot_plan_map maps lot_number → work planning row and is built once by
+    the caller. With include_summary=True returns (mpe_data, totals), where totals holds
+    total_qty, total_value and distinct_lots accumulated in the pricing loop.
+    """
+    mpe_data = fetch_stage_rows_cached(fetch_moulding_rows, lot_numbers)
+    return apply_moulding_pricing(mpe_data, lot_plan_map, get_item_rates(mpe_data), include_summary)
+
+
+def fetch_moulding_rows(lot_numbers):
+    """Fetch Moulding Production Entry rows for the lots, without pricing"""
+    
+    if not lot_numbers:
+        return []
+    
+    query = """
         SELECT 
             mpe.name as mpe_name,
             mpe.scan_lot_number as lot_no,
             DATE(mpe.moulding_date) as moulding_date,
             mpe.item_to_produce as item_code,
-            mpe.number_of_lifts as production_qty_nos,
+            CAST(IFNULL(mpe.number_of_lifts, 0) AS DOUBLE) as production_qty_nos,
             mpe.weight as weight_kg,
             mpe.no_of_running_cavities as cavities,
             (mpe.number_of_lifts * mpe.no_of_running_cavities) as total_pieces,
@@ -316,379 +724,246 @@ def get_moulding_data(lot_numbers, work_planning_lots):
             jc.workstation as machine_name
         FROM `tabMoulding Production Entry` mpe
         LEFT JOIN `tabJob Card` jc ON mpe.job_card = jc.name
-        WHERE mpe.scan_lot_number IN ({lot_numbers_str})
+        WHERE mpe.scan_lot_number IN %(lots)s
         AND mpe.docstatus = 1
         ORDER BY mpe.moulding_date DESC, mpe.scan_lot_number
     """
     
-    mpe_data = frappe.db.sql(query, as_dict=True)
-    
-    # Collect unique Material item codes (T-prefix) and convert to Finished Product codes (F-prefix)
-    material_items = set()
-    finished_items = []
-    t_to_f_map = {}  # Map T codes to F codes
+    return frappe.db.sql(query, {"lots": tuple(lot_numbers)}, as_dict=True)
+
+
+def apply_moulding_pricing(mpe_data, lot_plan_map, item_rates, include_summary=False):
+    """Add work planning info and Production Value to moulding rows"""
     
-    for row in mpe_data:
-        material_code = row.get('item_code')
-        if material_code:
-            material_items.add(material_code)
-            finished_code = convert_to_finished_product_code(material_code)
-            if finished_code:
-                finished_items.append(finished_code)
-                t_to_f_map[material_code] = finished_code
+    totals = {"total_qty": 0.0, "total_value": 0.0, "distinct_lots": 0}
+    lots_seen = set()
     
-    # Fetch remote pricing for Finished Product codes
-    pricing_map = fetch_remote_item_prices(finished_items)
-    
-    # Map pricing back to Material codes and populate data
     for row in mpe_data:
         lot_no = row['lot_no']
-        material_code = row.get('item_code')
         
         # Add work planning info
-        if lot_no in lot_plan_map:
-            row['work_plan'] = lot_plan_map[lot_no]['work_plan']
-            row['planned_date'] = lot_plan_map[lot_no]['planned_date']
-            row['plan_source'] = lot_plan_map[lot_no]['source']
+        plan = lot_plan_map.get(lot_no)
+        if plan:
+            row['work_plan'] = plan['work_plan']
+            row['planned_date'] = plan['planned_date']
+            row['plan_source'] = plan['source']
         else:
             row['work_plan'] = None
             row['planned_date'] = None
             row['plan_source'] = None
         
-        # Get rate from remote pricing
-        # Get rate from remote pricing
-        finished_code = t_to_f_map.get(material_code)
-        rate = pricing_map.get(finished_code, 0) if finished_code else 0
-        
-        # Fallback to local Item Price if remote pricing returns 0
-        if rate == 0 and material_code:
-            local_price = frappe.db.get_value(
-                'Item Price',
-                {'item_code': material_code, 'price_list': 'Standard Selling'},
-                'price_list_rate'
-            )
-            rate = flt(local_price) if local_price else 0
-            
+        rate = item_rates.get(row['item_code'], 0)
         row['item_rate'] = rate
         
         # Calculate Production Value = Qty × Rate
-        qty = flt(row.get('production_qty_nos', 0))
+        qty = row['production_qty_nos']
         row['production_value'] = qty * rate
+        
+        if include_summary:
+            totals["total_qty"] += qty
+            totals["total_value"] += row['production_value']
+            lots_seen.add(lot_no)
+    
+    if include_summary:
+        totals["distinct_lots"] = len(lots_seen)
+        return mpe_data, totals
     
     return mpe_data
 
 
 def get_lot_rejection_data(lot_numbers):
     """Stage 2: Get Lot Inspection rejection data with remote pricing"""
+    lot_data = fetch_stage_rows_cached(fetch_lot_rejection_rows, lot_numbers)
+    return apply_lot_rejection_pricing(lot_data, get_item_rates(lot_data))
+
+
+def fetch_lot_rejection_rows(lot_numbers):
+    """Fetch Lot Inspection rows for the lots, without pricing"""
     
     if not lot_numbers:
         return []
     
-    lot_numbers_str = "'" + "','".join(lot_numbers) + "'"
-    
-    # Fetch lot rejection data WITHOUT pricing (remove Item Price JOIN)
-    query = f"""
+    query = """
         SELECT 
             ie.name as inspection_entry,
             DATE(ie.posting_date) as inspection_date,
             ie.lot_no,
             ie.product_ref_no as item_code,
             ie.inspected_qty_nos,
-            ie.total_rejected_qty,
+            CAST(IFNULL(ie.total_rejected_qty, 0) AS DOUBLE) as total_rejected_qty,
             ie.total_rejected_qty_in_percentage as rejection_pct,
             ie.total_rejected_qty_kg as rejected_weight_kg
         FROM `tabInspection Entry` ie
-        WHERE ie.lot_no IN ({lot_numbers_str})
+        WHERE ie.lot_no IN %(lots)s
         AND ie.inspection_type = 'Lot Inspection'
         AND ie.docstatus = 1
         ORDER BY ie.posting_date DESC, ie.lot_no
     """
     
-    lot_data = frappe.db.sql(query, as_dict=True)
-    
-    # Collect unique Material item codes and convert to Finished Product codes
-    material_items = set()
-    finished_items = []
-    t_to_f_map = {}
-    
-    for row in lot_data:
-        material_code = row.get('item_code')
-        if material_code:
-            material_items.add(material_code)
-            finished_code = convert_to_finished_product_code(material_code)
-            if finished_code:
-                finished_items.append(finished_code)
-                t_to_f_map[material_code] = finished_code
-    
-    # Fetch remote pricing for Finished Product codes
-    pricing_map = fetch_remote_item_prices(finished_items)
+    return frappe.db.sql(query, {"lots": tuple(lot_numbers)}, as_dict=True)
+
+
+def apply_lot_rejection_pricing(lot_data, item_rates):
+    """Add Lot Rejection Cost to lot inspection rows"""
     
-    # Map pricing back to Material codes and calculate costs
     for row in lot_data:
-        material_code = row.get('item_code')
-        
-        # Get rate from remote pricing
-        # Get rate from remote pricing
-        finished_code = t_to_f_map.get(material_code)
-        rate = pricing_map.get(finished_code, 0) if finished_code else 0
-        
-        # Fallback to local Item Price if remote pricing returns 0
-        if rate == 0 and material_code:
-            local_price = frappe.db.get_value(
-                'Item Price',
-                {'item_code': material_code, 'price_list': 'Standard Selling'},
-                'price_list_rate'
-            )
-            rate = flt(local_price) if local_price else 0
-            
+        rate = item_rates.get(row['item_code'], 0)
         row['item_rate'] = rate
         
         # Calculate Lot Rejection Cost = Rejected Qty × Rate
-        rejected_qty = flt(row.get('total_rejected_qty', 0))
-        row['rejection_cost'] = rejected_qty * rate
+        row['rejection_cost'] = row['total_rejected_qty'] * rate
     
     return lot_data
 
 
 def get_incoming_inspection_data(lot_numbers):
     """Stage 3: Get Incoming Inspection data with defect breakdown and remote pricing"""
+    incoming_data = fetch_stage_rows_cached(fetch_incoming_rows, lot_numbers)
+    return apply_incoming_pricing(incoming_data, get_item_rates(incoming_data))
+
+
+def fetch_incoming_rows(lot_numbers):
+    """Fetch Incoming Inspection rows for the lots with their defect breakdown, without pricing"""
     
     if not lot_numbers:
         return []
     
-    lot_numbers_str = "'" + "','".join(lot_numbers) + "'"
-    
-    # Main query for incoming inspection WITHOUT pricing
-    query = f"""
+    # The defect types are pivoted into columns in the same statement, so each
+    # entry comes back as one row with its breakdown and C/M/RR % already summed
+    query = """
         SELECT 
             ie.name as inspection_entry,
             DATE(ie.posting_date) as inspection_date,
             ie.lot_no,
             ie.product_ref_no as item_code,
             ie.total_inspected_qty_nos as inspected_qty_nos,
-            ie.total_rejected_qty,
-            ie.total_rejected_qty_in_percentage as rejection_pct
+            CAST(IFNULL(ie.total_rejected_qty, 0) AS DOUBLE) as total_rejected_qty,
+            ie.total_rejected_qty_in_percentage as rejection_pct,
+            CAST(ROUND(IFNULL(SUM(CASE WHEN iei.type_of_defect = 'CUTMARK-(CU)' THEN iei.rejected_qty ELSE 0 END), 0), 2) AS DOUBLE) as cutmark_qty,
+            CAST(ROUND(IFNULL(SUM(CASE WHEN iei.type_of_defect IN ('RIB', 'RBS Rejection') THEN iei.rejected_qty ELSE 0 END), 0), 2) AS DOUBLE) as rbs_rejection_qty,
+            0 as impression_mark_qty,
+            CAST(ROUND(IFNULL(SUM(iei.rejected_qty), 0), 2) AS DOUBLE) as total_defect_qty
         FROM `tabInspection Entry` ie
-        WHERE ie.lot_no IN ({lot_numbers_str})
+        LEFT JOIN `tabInspection Entry Item` iei ON iei.parent = ie.name
+            AND iei.type_of_defect IN ('CUTMARK-(CU)', 'RIB', 'RBS Rejection')
+        WHERE ie.lot_no IN %(lots)s
         AND ie.inspection_type = 'Incoming Inspection'
         AND ie.docstatus = 1
+        GROUP BY ie.name
         ORDER BY ie.posting_date DESC, ie.lot_no
     """
     
-    incoming_data = frappe.db.sql(query, as_dict=True)
-    
-    # Collect unique Material item codes and convert to Finished Product codes
-    material_items = set()
-    finished_items = []
-    t_to_f_map = {}
+    incoming_data = frappe.db.sql(query, {"lots": tuple(lot_numbers)}, as_dict=True)
     
     for row in incoming_data:
-        material_code = row.get('item_code')
-        if material_code:
-            material_items.add(material_code)
-            finished_code = convert_to_finished_product_code(material_code)
-            if finished_code:
-                finished_items.append(finished_code)
-                t_to_f_map[material_code] = finished_code
+        # Calculate C/M/RR % = (Cutmark + RBS) / 200
+        row['cmrr_pct'] = (row['cutmark_qty'] + row['rbs_rejection_qty']) / 200.0
     
-    # Fetch remote pricing for Finished Product codes
-    pricing_map = fetch_remote_item_prices(finished_items)
+    return incoming_data
+
+
+def apply_incoming_pricing(incoming_data, item_rates):
+    """Add DF Vendor Cost and total rejection cost to incoming inspection rows"""
     
-    # Get defect details and calculate costs for each record
     for row in incoming_data:
-        defects = get_incoming_defects(row['inspection_entry'])
-        row['cutmark_qty'] = defects.get('cutmark', 0)
-        row['rbs_rejection_qty'] = defects.get('rbs', 0)
-        row['impression_mark_qty'] = defects.get('impression', 0)
-        
-        # Calculate C/M/RR % = (Cutmark + RBS) / 200
-        cmrr_pct = (row['cutmark_qty'] + row['rbs_rejection_qty']) / 200.0
-        row['cmrr_pct'] = cmrr_pct
-        
-        # Get rate from remote pricing
-        material_code = row.get('item_code')
-        finished_code = t_to_f_map.get(material_code)
-        rate = pricing_map.get(finished_code, 0) if finished_code else 0
-        
-        # Fallback to local Item Price if remote pricing returns 0
-        if rate == 0 and material_code:
-            local_price = frappe.db.get_value(
-                'Item Price',
-                {'item_code': material_code, 'price_list': 'Standard Selling'},
-                'price_list_rate'
-            )
-            rate = flt(local_price) if local_price else 0
-        
+        rate = item_rates.get(row['item_code'], 0)
         row['item_rate'] = rate
         
         # Calculate DF Vendor Cost = Sum(Defects) * Rate
         # More transparent calculation than inspected_qty * percentage
-        total_defects = row.get('cutmark_qty', 0) + row.get('rbs_rejection_qty', 0) + row.get('impression_mark_qty', 0)
-        row['df_vendor_cost'] = total_defects * rate
+        row['df_vendor_cost'] = row['total_defect_qty'] * rate
         
         # Also calculate total rejection cost
-        rejected_qty = flt(row.get('total_rejected_qty', 0))
-        row['total_rejection_cost'] = rejected_qty * rate
+        row['total_rejection_cost'] = row['total_rejected_qty'] * rate
     
     return incoming_data
 
 
-def get_incoming_defects(inspection_entry):
-    """Get defect breakdown for incoming inspection"""
-    
-    query = """
-        SELECT 
-            type_of_defect,
-            SUM(rejected_qty) as qty
-        FROM `tabInspection Entry Item`
-        WHERE parent = %s
-        AND type_of_defect IN ('CUTMARK-(CU)', 'RIB', 'RBS Rejection')
-        GROUP BY type_of_defect
-    """
-    
-    defects_data = frappe.db.sql(query, (inspection_entry,), as_dict=True)
-    
-    defects = {}
-    for row in defects_data:
-        reason = row['type_of_defect']
-        if reason == 'CUTMARK-(CU)':
-            defects['cutmark'] = flt(row['qty'], 2)
-        elif reason in ('RIB', 'RBS Rejection'):  # Handle both variations
-            defects['rbs'] = flt(row['qty'], 2)
-    
-    return defects
-
-
 def get_fvi_data(lot_numbers):
     """Stage 4: Get Final Inspection (FVI) data with defect breakdown and remote pricing"""
+    fvi_data = fetch_stage_rows_cached(fetch_fvi_rows, lot_numbers)
+    return apply_fvi_pricing(fvi_data, get_item_rates(fvi_data))
+
+
+def fetch_fvi_rows(lot_numbers):
+    """Fetch Final Visual Inspection rows for the lots with their defect breakdown, without pricing"""
     
     if not lot_numbers:
         return []
     
-    lot_numbers_str = "'" + "','".join(lot_numbers) + "'"
-    
-    # Fetch FVI data WITHOUT pricing
-    # FVI uses sublots (e.g., 25H06Y01-3) so we extract the main lot part
-    query = f"""
+    # FVI uses sublots (e.g., 25H06Y01-3) so we match on the generated main lot column.
+    # The defect types are pivoted into columns in the same statement, one row per entry.
+    query = """
         SELECT 
             sie.name as inspection_entry,
             DATE(sie.posting_date) as inspection_date,
             sie.lot_no,
             sie.product_ref_no as item_code,
-            sie.inspected_qty_nos as inspected_qty,
-            sie.total_rejected_qty as rejected_qty,
-            sie.total_rejected_qty_in_percentage as rejection_pct
+            CAST(IFNULL(sie.inspected_qty_nos, 0) AS DOUBLE) as inspected_qty,
+            CAST(IFNULL(sie.total_rejected_qty, 0) AS DOUBLE) as rejected_qty,
+            sie.total_rejected_qty_in_percentage as rejection_pct,
+            CAST(ROUND(IFNULL(SUM(CASE WHEN fvi.type_of_defect = 'OVER TRIM' THEN fvi.rejected_qty ELSE 0 END), 0), 2) AS DOUBLE) as over_trim_qty,
+            CAST(ROUND(IFNULL(SUM(CASE WHEN fvi.type_of_defect = 'UNDER FILL-( UF )' THEN fvi.rejected_qty ELSE 0 END), 0), 2) AS DOUBLE) as under_fill_qty
         FROM `tabSPP Inspection Entry` sie
-        WHERE SUBSTRING_INDEX(sie.lot_no, '-', 1) IN ({lot_numbers_str})
+        LEFT JOIN `tabFV Inspection Entry Item` fvi ON fvi.parent = sie.name
+            AND fvi.type_of_defect IN ('OVER TRIM', 'UNDER FILL-( UF )')
+        WHERE sie.main_lot_g IN %(lots)s
         AND sie.inspection_type = 'Final Visual Inspection'
         AND sie.docstatus = 1
+        GROUP BY sie.name
         ORDER BY sie.posting_date DESC, sie.lot_no
     """
     
-    fvi_data = frappe.db.sql(query, as_dict=True)
-    
-    # Collect unique Material item codes and convert to Finished Product codes
-    material_items = set()
-    finished_items = []
-    t_to_f_map = {}
+    fvi_data = frappe.db.sql(query, {"lots": tuple(lot_numbers)}, as_dict=True)
     
     for row in fvi_data:
-        material_code = row.get('item_code')
-        if material_code:
-            material_items.add(material_code)
-            finished_code = convert_to_finished_product_code(material_code)
-            if finished_code:
-                finished_items.append(finished_code)
-                t_to_f_map[material_code] = finished_code
+        # Calculate trimming percentage
+        inspected_qty = row['inspected_qty']
+        row['trimming_rejection_pct'] = (row['over_trim_qty'] / inspected_qty * 100) if inspected_qty > 0 else 0
     
-    # Fetch remote pricing for Finished Product codes
-    pricing_map = fetch_remote_item_prices(finished_items)
+    return fvi_data
+
+
+def apply_fvi_pricing(fvi_data, item_rates):
+    """Add trimming and final rejection costs to FVI rows"""
     
-    # Get defect details and calculate costs
     for row in fvi_data:
-        defects = get_fvi_defects(row['inspection_entry'])
-        row['over_trim_qty'] = defects.get('over_trim', 0)
-        row['under_fill_qty'] = defects.get('under_fill', 0)
-        
-        # Get rate from remote pricing
-        # Get rate from remote pricing
-        material_code = row.get('item_code')
-        finished_code = t_to_f_map.get(material_code)
-        rate = pricing_map.get(finished_code, 0) if finished_code else 0
-        
-        # Fallback to local Item Price if remote pricing returns 0
-        if rate == 0 and material_code:
-            local_price = frappe.db.get_value(
-                'Item Price',
-                {'item_code': material_code, 'price_list': 'Standard Selling'},
-                'price_list_rate'
-            )
-            rate = flt(local_price) if local_price else 0
-            
+        rate = item_rates.get(row['item_code'], 0)
         row['item_rate'] = rate
         
-        # Calculate trimming percentage and cost
-        # Calculate trimming percentage and cost
-        inspected_qty = flt(row.get('inspected_qty', 0))
-        trimming_pct = (row['over_trim_qty'] / inspected_qty * 100) if inspected_qty > 0 else 0
-        row['trimming_rejection_pct'] = trimming_pct
         row['trimming_cost'] = row['over_trim_qty'] * rate
         
         # Calculate Final Rejection Cost = (Rejected Qty × Rate)
         # Note: Rejected Qty already includes trimming rejects, so we don't add trimming_cost again
-        rejected_qty = flt(row.get('rejected_qty', 0))
-        rejection_cost = rejected_qty * rate
+        rejection_cost = row['rejected_qty'] * rate
         row['fvi_rejection_cost'] = rejection_cost
         row['total_fvi_cost'] = rejection_cost  # Was previously double-adding trimming_cost
     
     return fvi_data
 
 
-def get_fvi_defects(inspection_entry):
-    """Get defect breakdown for FVI"""
-    
-    query = """
-        SELECT 
-            type_of_defect,
-            SUM(rejected_qty) as qty
-        FROM `tabFV Inspection Entry Item`
-        WHERE parent = %s
-        AND type_of_defect IN ('OVER TRIM', 'UNDER FILL-( UF )')
-        GROUP BY type_of_defect
-    """
-    
-    defects_data = frappe.db.sql(query, (inspection_entry,), as_dict=True)
-    
-    defects = {}
-    for row in defects_data:
-        reason = row['type_of_defect']
-        if reason == 'OVER TRIM':
-            defects['over_trim'] = flt(row['qty'], 2)
-        elif reason == 'UNDER FILL-( UF )':
-            defects['under_fill'] = flt(row['qty'], 2)
-    
-    return defects
-
-
-def get_mpe_with_rates(lot_list):
+def get_mpe_with_rates(lot_list, include_summary=False):
     """Backwards compatible function for Phase 1"""
-    work_planning_lots = lot_list
-    lot_numbers = [lot['lot_number'] for lot in lot_list]
-    return get_moulding_data(lot_numbers, work_planning_lots)
+    lot_plan_map = {lot['lot_number']: lot for lot in lot_list}
+    return get_moulding_data(list(lot_plan_map), lot_plan_map, include_summary=include_summary)
 
 
-def calculate_summary(moulding_data, lot_rejection_data, incoming_data, fvi_data):
-    """Calculate overall summary across all stages"""
+def calculate_summary(moulding_totals, lot_rejection_data, incoming_data, fvi_data):
+    """
+    Calculate overall summary across all stages
+    
+    Moulding totals come from get_moulding_data(include_summary=True), which
+    accumulates them while pricing the rows, so moulding_data is not re-walked.
+    """
     
-    # Moulding totals
-    total_production_qty = sum([flt(row.get('production_qty_nos', 0)) for row in moulding_data])
-    total_production_value = sum([flt(row.get('production_value', 0)) for row in moulding_data])
-    total_lots = len(set([row['lot_no'] for row in moulding_data]))
+    total_production_qty = moulding_totals["total_qty"]
+    total_production_value = moulding_totals["total_value"]
+    total_lots = moulding_totals["distinct_lots"]
     
-    # Rejection costs
-    lot_rejection_cost = sum([flt(row.get('rejection_cost', 0)) for row in lot_rejection_data])
-    incoming_cost = sum([flt(row.get('df_vendor_cost', 0)) for row in incoming_data])
-    fvi_cost = sum([flt(row.get('total_fvi_cost', 0)) for row in fvi_data])
+    # Rejection costs (float products computed per row by each stage)
+    lot_rejection_cost = sum(row['rejection_cost'] for row in lot_rejection_data)
+    incoming_cost = sum(row['df_vendor_cost'] for row in incoming_data)
+    fvi_cost = sum(row['total_fvi_cost'] for row in fvi_data)
     
     total_rejection_cost = lot_rejection_cost + incoming_cost + fvi_cost
     
@@ -8,8 +8,22 @@ from frappe.utils import flt, getdate, add_days
 from collections import defaultdict
 import json
 
-def analyze_data_patterns():
-    """Analyze data from all three primary doctypes"""
+DATA_PATTERNS_CACHE_KEY = "rejection_analysis_data_patterns"
+# Outlives the daily refresh so the roll-up never lapses between runs
+DATA_PATTERNS_CACHE_TTL = 90000
+
+def analyze_data_patterns(refresh=False):
+    """Analyze data from all three primary doctypes
+    
+    The roll-up scans every submitted entry, so the result is kept in Redis
+    and rebuilt nightly by refresh_data_patterns; pass refresh=True to
+    recompute it on demand.
+    """
+    
+    if not refresh:
+        cached = frappe.cache().get_value(DATA_PATTERNS_CACHE_KEY)
+        if cached is not None:
+            return cached
     
     patterns = {
         "date_range": get_date_range(),
@@ -23,8 +37,14 @@ def analyze_data_patterns():
         "batch_analysis": get_batch_analysis()
     }
     
+    frappe.cache().set_value(DATA_PATTERNS_CACHE_KEY, patterns, expires_in_sec=DATA_PATTERNS_CACHE_TTL)
+    
     return patterns
 
+def refresh_data_patterns():
+    """Rebuild the cached data pattern roll-up (daily scheduler job)"""
+    analyze_data_patterns(refresh=True)
+
 def get_date_range():
     """Get the date range of available data"""
     mpe_dates = frappe.db.sql("""
@@ -77,18 +97,18 @@ def get_rejection_trends():
     """Get rejection trends over time (last 30 days)"""
     data = frappe.db.sql("""
         SELECT 
-            DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d') as date,
+            DATE(mpe.moulding_date) as date,
             ie.inspection_type,
             COUNT(*) as inspection_count,
             AVG(ie.total_rejected_qty_in_percentage) as avg_rejection_pct,
             SUM(ie.total_rejected_qty) as total_rejected_qty
-        FROM `tabInspection Entry` ie
-        LEFT JOIN `tabMoulding Production Entry` mpe
-            ON mpe.scan_lot_number = ie.lot_no
-        WHERE ie.docstatus = 1
-        AND mpe.moulding_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-        GROUP BY DATE_FORMAT(mpe.moulding_date, '%%Y-%%m-%%d'), ie.inspection_type
-        ORDER BY mpe.moulding_date DESC
+        FROM `tabMoulding Production Entry` mpe
+        INNER JOIN `tabInspection Entry` ie
+            ON ie.lot_no = mpe.scan_lot_number
+            AND ie.docstatus = 1
+        WHERE mpe.moulding_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+        GROUP BY DATE(mpe.moulding_date), ie.inspection_type
+        ORDER BY date DESC
     """, as_dict=True)
     
     return data
@@ -98,16 +118,16 @@ def get_defect_distribution():
     # From Inspection Entry Items
     ie_defects = frappe.db.sql("""
         SELECT 
-            type_of_defect,
+            iei.type_of_defect,
             COUNT(*) as occurrence_count,
-            SUM(rejected_qty) as total_rejected_qty
-        FROM `tabInspection Entry Item`
-        WHERE parent IN (
-            SELECT name FROM `tabInspection Entry` WHERE docstatus = 1
-        )
-        AND type_of_defect IS NOT NULL
-        AND type_of_defect != ''
-        GROUP BY type_of_defect
+            SUM(iei.rejected_qty) as total_rejected_qty
+        FROM `tabInspection Entry Item` iei
+        INNER JOIN `tabInspection Entry` ie
+            ON ie.name = iei.parent
+            AND ie.docstatus = 1
+        WHERE iei.type_of_defect IS NOT NULL
+        AND iei.type_of_defect != ''
+        GROUP BY iei.type_of_defect
         ORDER BY occurrence_count DESC
         LIMIT 10
     """, as_dict=True)
@@ -115,16 +135,16 @@ def get_defect_distribution():
     # From SPP Inspection Entry Items
     spp_defects = frappe.db.sql("""
         SELECT 
-            type_of_defect,
+            fvi.type_of_defect,
             COUNT(*) as occurrence_count,
-            SUM(rejected_qty) as total_rejected_qty
-        FROM `tabFV Inspection Entry Item`
-        WHERE parent IN (
-            SELECT name FROM `tabSPP Inspection Entry` WHERE docstatus = 1
-        )
-        AND type_of_defect IS NOT NULL
-        AND type_of_defect != ''
-        GROUP BY type_of_defect
+            SUM(fvi.rejected_qty) as total_rejected_qty
+        FROM `tabFV Inspection Entry Item` fvi
+        INNER JOIN `tabSPP Inspection Entry` sie
+            ON sie.name = fvi.parent
+            AND sie.docstatus = 1
+        WHERE fvi.type_of_defect IS NOT NULL
+        AND fvi.type_of_defect != ''
+        GROUP BY fvi.type_of_defect
         ORDER BY occurrence_count DESC
         LIMIT 10
     """, as_dict=True)
@@ -247,5 +267,5 @@ def get_batch_analysis():
 
 # Run the analysis
 if __name__ == "__main__":
-    patterns = analyze_data_patterns()
+    patterns = analyze_data_patterns(refresh=True)
     print(json.dumps(patterns, indent=2, default=str))
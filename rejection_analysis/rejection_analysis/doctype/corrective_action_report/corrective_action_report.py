@@ -11,160 +11,123 @@ from frappe.utils import now
 class CorrectiveActionReport(Document):
 	def validate(self):
 		self.validate_dates()
-		# Only update CAR status if the document already exists (not on first insert)
-		if not self.is_new():
+		# Only update CAR status if the document already exists (not on first insert);
+		# on submit, on_submit writes the row in one update
+		if not self.is_new() and self._action != "submit":
 			self.update_car_status_in_report()
 
 	def validate_dates(self):
 		"""Validate CAR date and target date"""
 		from frappe.utils import getdate
 		
-		# Ensure dates are date objects, not strings - be very defensive
+		# Normalise both dates once so every comparison below is date-to-date
 		if self.car_date:
-			if isinstance(self.car_date, str):
-				self.car_date = getdate(self.car_date)
+			self.car_date = getdate(self.car_date)
 		
 		if self.target_date:
-			if isinstance(self.target_date, str):
-				self.target_date = getdate(self.target_date)
+			self.target_date = getdate(self.target_date)
 		
-		# Now safely compare dates
-		try:
-			if self.car_date and self.car_date > frappe.utils.today():
-				frappe.throw(_("CAR date cannot be in the future"))
-
-			if self.target_date and self.car_date and self.target_date < self.car_date:
-				frappe.throw(_("Target date cannot be before CAR date"))
-		except (TypeError, AttributeError) as e:
-			# If comparison still fails, convert and retry
-			frappe.log_error(f"Date validation error: {str(e)}", "CAR Date Validation")
-			self.car_date = getdate(self.car_date) if self.car_date else frappe.utils.today()
-			if self.target_date:
-				self.target_date = getdate(self.target_date)
+		if self.car_date and self.car_date > getdate(frappe.utils.today()):
+			frappe.throw(_("CAR date cannot be in the future"))
+
+		if self.target_date and self.car_date and self.target_date < self.car_date:
+			frappe.throw(_("Target date cannot be before CAR date"))
+
+	def get_report_item(self):
+		"""
+		Find the Daily Rejection Report row for this CAR's inspection entry.
+		
+		Checks the Lot, Incoming and Final Inspection Report Item tables in that
+		order with one query, and returns the row's doctype, name, car_reference
+		and car_status, or None.
+		"""
+		if not self.inspection_entry:
+			return None
+		
+		# Final Inspection Report Item links through spp_inspection_entry.
+		# priority keeps the lot → incoming → final precedence, then latest modified first
+		rows = frappe.db.sql("""
+			SELECT 1 as priority, 'Lot Inspection Report Item' as doctype, name, car_reference, car_status, modified
+			FROM `tabLot Inspection Report Item`
+			WHERE inspection_entry = %(entry)s
+			UNION ALL
+			SELECT 2, 'Incoming Inspection Report Item', name, car_reference, car_status, modified
+			FROM `tabIncoming Inspection Report Item`
+			WHERE inspection_entry = %(entry)s
+			UNION ALL
+			SELECT 3, 'Final Inspection Report Item', name, car_reference, car_status, modified
+			FROM `tabFinal Inspection Report Item`
+			WHERE spp_inspection_entry = %(entry)s
+			ORDER BY priority, modified DESC
+			LIMIT 1
+		""", {"entry": self.inspection_entry}, as_dict=True)
+		
+		return rows[0] if rows else None
 
 	def update_car_status_in_report(self):
 		"""Update CAR status in the related Daily Rejection Report"""
-		if self.inspection_entry:
-			# Check all three child tables for the inspection entry
-			# Lot Inspection Report Item
-			lot_items = frappe.get_all(
-				"Lot Inspection Report Item",
-				filters={"inspection_entry": self.inspection_entry},
-				fields=["name", "parent"]
-			)
-			
-			if lot_items:
-				frappe.db.set_value(
-					"Lot Inspection Report Item",
-					lot_items[0].name,
-					{
-						"car_reference": self.name,
-						"car_status": self.status
-					}
-				)
-				return
-			
-			# Incoming Inspection Report Item
-			incoming_items = frappe.get_all(
-				"Incoming Inspection Report Item",
-				filters={"inspection_entry": self.inspection_entry},
-				fields=["name", "parent"]
+		report_item = self.get_report_item()
+		# Rewrite the row whenever the reference or status is missing or stale, not only
+		# when this save changed the status; skip the write when it is already current
+		if report_item and (report_item.car_reference, report_item.car_status) != (self.name, self.status):
+			frappe.db.set_value(
+				report_item.doctype,
+				report_item.name,
+				{
+					"car_reference": self.name,
+					"car_status": self.status
+				},
+				update_modified=False
 			)
-			
-			if incoming_items:
-				frappe.db.set_value(
-					"Incoming Inspection Report Item",
-					incoming_items[0].name,
-					{
-						"car_reference": self.name,
-						"car_status": self.status
-					}
-				)
-				return
-			
-			# Final Inspection Report Item (uses spp_inspection_entry field)
-			final_items = frappe.get_all(
-				"Final Inspection Report Item",
-				filters={"spp_inspection_entry": self.inspection_entry},
-				fields=["name", "parent"]
-			)
-			
-			if final_items:
-				frappe.db.set_value(
-					"Final Inspection Report Item",
-					final_items[0].name,
-					{
-						"car_reference": self.name,
-						"car_status": self.status
-					}
-				)
 
 	def before_submit(self):
 		if not self.corrective_action:
 			frappe.throw(_("Corrective Action is required before submitting"))
 
 	def on_submit(self):
-		# Mark CAR as created in the report (check all three child tables)
-		if self.inspection_entry:
-			# Lot Inspection Report Item
-			lot_items = frappe.get_all(
-				"Lot Inspection Report Item",
-				filters={"inspection_entry": self.inspection_entry},
-				fields=["name"]
-			)
-			
-			if lot_items:
-				frappe.db.set_value(
-					"Lot Inspection Report Item",
-					lot_items[0].name,
-					"car_required",
-					1
-				)
-				return
-			
-			# Incoming Inspection Report Item
-			incoming_items = frappe.get_all(
-				"Incoming Inspection Report Item",
-				filters={"inspection_entry": self.inspection_entry},
-				fields=["name"]
-			)
-			
-			if incoming_items:
-				frappe.db.set_value(
-					"Incoming Inspection Report Item",
-					incoming_items[0].name,
-					"car_required",
-					1
-				)
-				return
-			
-			# Final Inspection Report Item
-			final_items = frappe.get_all(
-				"Final Inspection Report Item",
-				filters={"spp_inspection_entry": self.inspection_entry},
-				fields=["name"]
+		# Mark CAR as created in the report along with its latest status, in one update
+		report_item = self.get_report_item()
+		if report_item:
+			frappe.db.set_value(
+				report_item.doctype,
+				report_item.name,
+				{
+					"car_reference": self.name,
+					"car_status": self.status,
+					"car_required": 1
+				},
+				update_modified=False
 			)
-			
-			if final_items:
-				frappe.db.set_value(
-					"Final Inspection Report Item",
-					final_items[0].name,
-					"car_required",
-					1
-				)
 
 @frappe.whitelist()
 def create_car_from_inspection(inspection_entry_name):
 	"""Create a CAR from an inspection entry"""
 
-	# Get inspection entry
-	inspection = frappe.get_doc("Inspection Entry", inspection_entry_name)
+	# Get only the inspection entry fields the CAR uses, not the whole document
+	inspection = frappe.db.get_value(
+		"Inspection Entry",
+		inspection_entry_name,
+		[
+			"lot_no", "product_ref_no", "inspection_type", "total_rejected_qty_in_percentage",
+			"total_inspected_qty_nos", "total_rejected_qty", "inspector_name", "machine_no",
+			"operator_name"
+		],
+		as_dict=True
+	)
+	if not inspection:
+		frappe.throw(_("Inspection Entry {0} not found").format(inspection_entry_name), frappe.DoesNotExistError)
+
+	defect_rows = frappe.db.sql("""
+		SELECT type_of_defect, rejected_qty
+		FROM `tabInspection Entry Item`
+		WHERE parent = %s
+		AND parenttype = 'Inspection Entry'
+		AND rejected_qty > 0
+		ORDER BY idx
+	""", inspection_entry_name, as_dict=True)
 
 	# Build problem description from defect details
-	defects = []
-	for item in inspection.items:
-		if item.rejected_qty > 0:
-			defects.append(f"{item.type_of_defect}: {item.rejected_qty}")
+	defects_text = "\n".join(f"{item.type_of_defect}: {item.rejected_qty}" for item in defect_rows)
 
 	problem_desc = f"""High rejection ({inspection.total_rejected_qty_in_percentage}%) found in {inspection.inspection_type} for lot {inspection.lot_no}.
 
@@ -176,7 +139,7 @@ Machine: {inspection.machine_no}
 Operator: {inspection.operator_name}
 
 Defects Found:
-{chr(10).join(defects)}"""
+{defects_text}"""
 
 	# Create CAR
 	car = frappe.get_doc({
@@ -197,16 +160,47 @@ Defects Found:
 def save_five_why_analysis(car_name, why_answers):
 	"""Save 5 Why analysis answers"""
 
-	car = frappe.get_doc("Corrective Action Report", car_name)
-
-	# Clear existing analysis
-	car.set("five_why_analysis", [])
-
-	# Add new analysis
-	for i, answer in enumerate(why_answers, 1):
-		car.append("five_why_analysis", {
-			f"why_{i}": answer
-		})
+	# Same guards car.save() applied: write permission and a draft CAR
+	frappe.has_permission("Corrective Action Report", "write", car_name, throw=True)
+	if frappe.db.get_value("Corrective Action Report", car_name, "docstatus") != 0:
+		frappe.throw(_("5 Why analysis can only be changed while the CAR is a draft"))
+
+	# Replace the child rows directly: one DELETE and one multi-row INSERT
+	# instead of reloading and re-validating the whole CAR
+	frappe.db.delete("Five Why Analysis", {
+		"parent": car_name,
+		"parenttype": "Corrective Action Report",
+		"parentfield": "five_why_analysis"
+	})
 
-	car.save()
-	return {"status": "success"}
\ No newline at end of file
+	timestamp = now()
+	user = frappe.session.user
+	why_fields = [f"why_{n}" for n in range(1, 6)]
+
+	# Each answer keeps its own row, with only its why_N column filled
+	rows = [
+		(
+			frappe.generate_hash(length=10), timestamp, timestamp, user, user, 0,
+			car_name, "Corrective Action Report", "five_why_analysis", i,
+			*(answer if n == i else None for n in range(1, 6))
+		)
+		for i, answer in enumerate(why_answers, 1)
+	]
+
+	if rows:
+		frappe.db.bulk_insert(
+			"Five Why Analysis",
+			fields=[
+				"name", "creation", "modified", "owner", "modified_by", "docstatus",
+				"parent", "parenttype", "parentfield", "idx", *why_fields
+			],
+			values=rows
+		)
+
+	frappe.db.set_value(
+		"Corrective Action Report",
+		car_name,
+		{"modified": timestamp, "modified_by": user},
+		update_modified=False
+	)
+	return {"status": "success"}
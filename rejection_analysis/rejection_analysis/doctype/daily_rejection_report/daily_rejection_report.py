@@ -7,6 +7,18 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 from frappe.utils import now, get_datetime
+import re
+
+# 't.' / 'T.' markers stripped from item codes before the T → F translation
+_T_DOT_RE = re.compile(r'[tT]\.')
+_FIRST_WORD_RE = re.compile(r'\S+')
+
+def get_pricing_item_code(item_code):
+	"""Translate a report T-item code to the F-item priced on the Sales site, or None"""
+	# Clean up: remove 't.', 'T.', spaces, get first word
+	match = _FIRST_WORD_RE.search(_T_DOT_RE.sub('', str(item_code)))
+	cleaned = match.group(0) if match else ''
+	return 'F' + cleaned[1:] if cleaned[:1] in ('t', 'T') else None
 
 class DailyRejectionReport(Document):
 	def before_save(self):
@@ -22,7 +34,12 @@ class DailyRejectionReport(Document):
 
 	def validate_report_date(self):
 		"""Ensure report date is not in future"""
-		if self.report_date > frappe.utils.today():
+		# frappe.flags is reset per request/job, so today's date is resolved once per request
+		today = frappe.flags.daily_rejection_report_today
+		if not today:
+			today = frappe.flags.daily_rejection_report_today = frappe.utils.today()
+
+		if self.report_date > today:
 			frappe.throw(_("Report date cannot be in the future"))
 	
 	def calculate_rejection_costs(self):
@@ -31,58 +48,43 @@ class DailyRejectionReport(Document):
 		Uses remote Item Price API to fetch pricing from Sales site.
 		"""
 		from rejection_analysis.rejection_analysis.api import fetch_remote_item_prices_batch
+		from rejection_analysis.rejection_analysis.cost_analysis_api import get_remote_pricing_config
 		from frappe.utils import flt
 		
-		# Get remote pricing configuration
-		try:
-			settings = frappe.get_single("Rejection Analysis Settings")
-			remote_url = settings.sales_site_url or ""
-			api_key = settings.sales_site_api_key or ""
-			api_secret = settings.get_password("sales_site_api_secret") or ""
-		except Exception:
-			# Fallback to site_config if settings not configured
-			remote_url = frappe.conf.get("sales_site_url") or ""
-			api_key = frappe.conf.get("sales_site_api_key") or ""
-			api_secret = frappe.conf.get("sales_site_api_secret") or ""
+		# Get remote pricing configuration (Settings or site_config, cached across saves)
+		remote_url, api_key, api_secret = get_remote_pricing_config()
 		
 		if not (remote_url and api_key and api_secret):
 			# No pricing configuration - skip cost calculation
 			return
 		
-		# Collect all unique T-item codes from all child tables
-		item_codes = set()
+		# Transform T-items to F-items for pricing lookup; each code is cleaned once
+		item_mapping = {}  # Maps T-item -> F-item (None for non T-items)
 		
-		# From Incoming Inspection Items
-		for item in self.get("incoming_inspection_items", []):
-			if item.item:
-				item_codes.add(item.item)
+		def to_f_item(t_item):
+			if t_item not in item_mapping:
+				item_mapping[t_item] = get_pricing_item_code(t_item)
+			return item_mapping[t_item]
 		
-		# From Final Inspection Items
-		for item in self.get("final_inspection_items", []):
-			if item.item:
-				item_codes.add(item.item)
+		# Pair each priceable child row with its F-item in a single pass per child table
+		incoming_rows = [
+			(item, f_item) for item in self.get("incoming_inspection_items", [])
+			if item.item and (f_item := to_f_item(item.item))
+		]
+		final_rows = [
+			(item, f_item) for item in self.get("final_inspection_items", [])
+			if item.item and (f_item := to_f_item(item.item))
+		]
+		lot_rows = [
+			(item, f_item) for item in self.get("lot_inspection_items", [])
+			if item.item_code and (f_item := to_f_item(item.item_code))
+		]
 		
-		# From Lot Inspection Items
-		for item in self.get("lot_inspection_items", []):
-			if item.item_code:
-				item_codes.add(item.item_code)
+		pricing_item_codes = {f_item for f_item in item_mapping.values() if f_item}
 		
-		if not item_codes:
+		if not pricing_item_codes:
 			return
 		
-		# Transform T-items to F-items for pricing lookup
-		pricing_item_codes = set()
-		item_mapping = {}  # Maps T-item -> F-item
-		
-		for t_item in item_codes:
-			if t_item:
-				# Clean up: remove 't.', 'T.', spaces, get first word
-				cleaned = str(t_item).strip().replace('t.', '').replace('T.', '').split()[0]
-				if cleaned.upper().startswith('T'):
-					f_item = 'F' + cleaned[1:]
-					pricing_item_codes.add(f_item)
-					item_mapping[t_item] = f_item
-		
 		# Fetch pricing in batch
 		pricing_map = fetch_remote_item_prices_batch(
 			list(pricing_item_codes),
@@ -91,39 +93,35 @@ class DailyRejectionReport(Document):
 			api_secret
 		)
 		
+		# before_save runs ahead of Frappe's numeric type fixing, so child quantities
+		# posted from desk or REST may still be strings; flt() coerces them
 		# Update costs for Incoming Inspection Items
-		for item in self.get("incoming_inspection_items", []):
-			if item.item and item.item in item_mapping:
-				f_item = item_mapping[item.item]
-				unit_cost = pricing_map.get(f_item, 0)
-				item.unit_cost = unit_cost
-				item.rejection_cost = flt(item.rejected_qty or 0) * unit_cost
+		for item, f_item in incoming_rows:
+			unit_cost = pricing_map.get(f_item, 0)
+			item.unit_cost = unit_cost
+			item.rejection_cost = flt(item.rejected_qty or 0) * unit_cost
 		
 		# Update costs for Final Inspection Items
-		for item in self.get("final_inspection_items", []):
-			if item.item and item.item in item_mapping:
-				f_item = item_mapping[item.item]
-				unit_cost = pricing_map.get(f_item, 0)
-				item.unit_cost = unit_cost
-				item.fvi_rejection_cost = flt(item.final_rej_qty or 0) * unit_cost
+		for item, f_item in final_rows:
+			unit_cost = pricing_map.get(f_item, 0)
+			item.unit_cost = unit_cost
+			item.fvi_rejection_cost = flt(item.final_rej_qty or 0) * unit_cost
 		
 		# Update costs for Lot Inspection Items (use actual rejected qty from IE)
-		for item in self.get("lot_inspection_items", []):
-			if item.item_code and item.item_code in item_mapping:
-				f_item = item_mapping[item.item_code]
-				unit_cost = pricing_map.get(f_item, 0)
-				item.unit_cost = unit_cost
-				
-				# Use actual rejected_qty from Inspection Entry (already populated during report generation)
-				# Don't calculate from percentages - use the real data
-				rejected_qty = flt(item.rejected_qty or 0)
-				
-				# Calculate total cost using actual rejected quantity
-				item.total_rejection_cost = rejected_qty * unit_cost
-				
-				# Note: We keep the stage-wise percentage fields (patrol_rej_pct, line_rej_pct, lot_rej_pct)
-				# for display purposes, but don't calculate stage-wise rejected quantities or costs
-				# since the business process records total rejected qty, not stage-wise quantities
+		for item, f_item in lot_rows:
+			unit_cost = pricing_map.get(f_item, 0)
+			item.unit_cost = unit_cost
+			
+			# Use actual rejected_qty from Inspection Entry (already populated during report generation)
+			# Don't calculate from percentages - use the real data
+			rejected_qty = flt(item.rejected_qty or 0)
+			
+			# Calculate total cost using actual rejected quantity
+			item.total_rejection_cost = rejected_qty * unit_cost
+			
+			# Note: We keep the stage-wise percentage fields (patrol_rej_pct, line_rej_pct, lot_rej_pct)
+			# for display purposes, but don't calculate stage-wise rejected quantities or costs
+			# since the business process records total rejected qty, not stage-wise quantities
 
 
 @frappe.whitelist()
@@ -7,11 +7,27 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+THRESHOLD_CACHE_KEY = "rejection_threshold_config"
+# Shares the prefix above, so clear_threshold_cache() drops it too
+ACTIVE_COUNT_CACHE_KEY = f"{THRESHOLD_CACHE_KEY}:active_count"
+
+DEFAULT_THRESHOLD = {
+	"threshold_percentage": 5.0,
+	"warning_threshold": 3.0,
+	"critical_threshold": 10.0
+}
+
 class RejectionThresholdConfiguration(Document):
 	def validate(self):
 		self.validate_thresholds()
 		self.validate_uniqueness()
 
+	def on_update(self):
+		clear_threshold_cache()
+
+	def on_trash(self):
+		clear_threshold_cache()
+
 	def validate_thresholds(self):
 		"""Validate threshold values"""
 		if self.warning_threshold and self.threshold_percentage:
@@ -30,9 +46,10 @@ class RejectionThresholdConfiguration(Document):
 		"""Ensure unique configuration for inspection type + product/item group combination"""
 		filters = {
 			"inspection_type": self.inspection_type,
-			"is_active": 1,
-			"name": ["!=", self.name] if self.name else []
+			"is_active": 1
 		}
+		if self.name:
+			filters["name"] = ["!=", self.name]
 
 		# Check for product-specific config
 		if self.product_ref_no:
@@ -45,62 +62,71 @@ class RejectionThresholdConfiguration(Document):
 			filters["product_ref_no"] = ["is", "not set"]
 			filters["item_group"] = ["is", "not set"]
 
-		existing = frappe.get_all(
-			"Rejection Threshold Configuration",
-			filters=filters,
-			fields=["name"]
-		)
-
-		if existing:
+		if frappe.db.exists("Rejection Threshold Configuration", filters):
 			frappe.throw(_("Configuration already exists for this inspection type and product/item group combination"))
 
+def clear_threshold_cache():
+	"""Drop every cached threshold lookup; any configuration change can alter the resolved hierarchy"""
+	frappe.cache().delete_keys(THRESHOLD_CACHE_KEY)
+
 @frappe.whitelist()
 def get_threshold_for_inspection_type(inspection_type, product_ref_no=None, item_group=None):
 	"""Get threshold percentage for inspection type, considering product/item group hierarchy"""
 
-	# Priority: Product specific > Item Group > Global default
-	filters = {
-		"inspection_type": inspection_type,
-		"is_active": 1
-	}
-
-	# Try product-specific first
-	if product_ref_no:
-		product_config = frappe.get_all(
-			"Rejection Threshold Configuration",
-			filters={**filters, "product_ref_no": product_ref_no},
-			fields=["threshold_percentage", "warning_threshold", "critical_threshold"]
-		)
-		if product_config:
-			return product_config[0]
-
-	# Try item group
-	if item_group:
-		group_config = frappe.get_all(
-			"Rejection Threshold Configuration",
-			filters={**filters, "item_group": item_group},
-			fields=["threshold_percentage", "warning_threshold", "critical_threshold"]
+	# Sites without any active configuration always resolve to the defaults
+	if not get_active_configuration_count():
+		return dict(DEFAULT_THRESHOLD)
+
+	# Configurations rarely change, so resolved thresholds (defaults included) are
+	# served from Redis until a configuration is saved or deleted
+	cache_key = f"{THRESHOLD_CACHE_KEY}:{inspection_type}:{product_ref_no or ''}:{item_group or ''}"
+	threshold = frappe.cache().get_value(cache_key)
+	if threshold is None:
+		threshold = lookup_threshold(inspection_type, product_ref_no, item_group)
+		frappe.cache().set_value(cache_key, threshold)
+
+	return threshold
+
+def get_active_configuration_count():
+	"""Number of active threshold configurations, cached until a configuration changes"""
+	count = frappe.cache().get_value(ACTIVE_COUNT_CACHE_KEY)
+	if count is None:
+		count = frappe.db.count("Rejection Threshold Configuration", {"is_active": 1})
+		frappe.cache().set_value(ACTIVE_COUNT_CACHE_KEY, count)
+
+	return count
+
+def lookup_threshold(inspection_type, product_ref_no=None, item_group=None):
+	"""Resolve the threshold configuration from the database"""
+
+	# Priority: Product specific > Item Group > Global default, ranked in one query.
+	# Within a level the most recently modified configuration wins.
+	config = frappe.db.sql("""
+		SELECT threshold_percentage, warning_threshold, critical_threshold
+		FROM `tabRejection Threshold Configuration`
+		WHERE inspection_type = %(inspection_type)s
+		AND is_active = 1
+		AND (
+			(%(product_ref_no)s != '' AND product_ref_no = %(product_ref_no)s)
+			OR (%(item_group)s != '' AND item_group = %(item_group)s)
+			OR (IFNULL(product_ref_no, '') = '' AND IFNULL(item_group, '') = '')
 		)
-		if group_config:
-			return group_config[0]
-
-	# Try global default (no product/item group specified)
-	global_config = frappe.get_all(
-		"Rejection Threshold Configuration",
-		filters={
-			**filters,
-			"product_ref_no": ["is", "not set"],
-			"item_group": ["is", "not set"]
-		},
-		fields=["threshold_percentage", "warning_threshold", "critical_threshold"]
-	)
-
-	if global_config:
-		return global_config[0]
+		ORDER BY
+			CASE
+				WHEN %(product_ref_no)s != '' AND product_ref_no = %(product_ref_no)s THEN 1
+				WHEN %(item_group)s != '' AND item_group = %(item_group)s THEN 2
+				ELSE 3
+			END,
+			modified DESC
+		LIMIT 1
+	""", {
+		"inspection_type": inspection_type,
+		"product_ref_no": product_ref_no or "",
+		"item_group": item_group or ""
+	}, as_dict=True)
+
+	if config:
+		return config[0]
 
 	# Return default values if no configuration found
-	return {
-		"threshold_percentage": 5.0,
-		"warning_threshold": 3.0,
-		"critical_threshold": 10.0
-	}
\ No newline at end of file
+	return dict(DEFAULT_THRESHOLD)
\ No newline at end of file
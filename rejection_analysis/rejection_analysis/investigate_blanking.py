@@ -1,64 +1,117 @@
 import frappe
 import json
 
-def investigate():
-    bin_code = 'BLB -00068'
-    lot_no = '25K04V03'
-    
-    print(f"Investigating Bin: {bin_code}")
-    
-    # Get Blanking DC Entries for this bin
+def investigate(bin_codes=('BLB -00068',), lots=('25K04V03',)):
+    bin_codes = list(bin_codes)
+    lots = list(lots)
+
+    print(f"Investigating Bins: {', '.join(bin_codes)}")
+
+    # Get Blanking DC Entries for these bins
     # Use REPLACE to match bin codes with/without spaces
     entries = frappe.db.sql("""
-        SELECT name, bin_code, item_produced, item_to_produce, t_item_to_produce, spp_batch_number, employee, posting_date, creation, docstatus 
-        FROM `tabBlanking DC Entry` 
-        WHERE REPLACE(bin_code, ' ', '') = %s
-        ORDER BY creation desc 
-        LIMIT 20
-    """, (bin_code.replace(' ', ''),), as_dict=1)
-    
-    print("\nMatches for Bin (Normalized):")
+        SELECT name, bin_code, item_produced, item_to_produce, t_item_to_produce, spp_batch_number, employee, posting_date, creation, docstatus
+        FROM `tabBlanking DC Entry`
+        WHERE REPLACE(bin_code, ' ', '') IN %s
+        ORDER BY creation desc
+        LIMIT %s
+    """, (tuple(b.replace(' ', '') for b in bin_codes), 20 * len(bin_codes)), as_dict=1)
+
+    print("\nMatches for Bins (Normalized):")
     for e in entries:
-        print(f"Name: {e.name}, Item: {e.item_produced}, Batch: {e.spp_batch_number}, Created: {e.creation}, Status: {e.docstatus}")
-    
-    # Get MPE for the lot
-    mpe = frappe.db.get_value('Moulding Production Entry', 
-                             {'scan_lot_number': lot_no}, 
-                             ['name', 'moulding_date', 'item_to_produce', 'batch_details', 'creation', 'compound'], 
-                             as_dict=1)
-    
-    if mpe:
-        print("\nMPE Details:")
-        print(json.dumps(mpe, indent=4, default=str))
-        
-        # Test the SQL logic
-        item = mpe['item_to_produce']
-        moulding_date = mpe['moulding_date']
-        
-        # We need to parse batch_details to get the spp_batch_number which we use in SQL
-        batch_details = json.loads(mpe['batch_details'] or '[]')
-        batch_val = ""
-        for d in batch_details:
-            if d.get('bin') == bin_code:
-                batch_val = d.get('spp_batch_number', "")
-                break
-        
-        print(f"\nExtracted Batch No from MPE for this bin: {batch_val}")
-        
-        blanking_sql = """
-            SELECT name, employee, item_produced, item_to_produce, t_item_to_produce, spp_batch_number, posting_date, creation
-            FROM `tabBlanking DC Entry`
-            WHERE bin_code = %s 
-            AND (item_produced = %s OR item_to_produce = %s OR t_item_to_produce = %s OR spp_batch_number = %s)
-            AND docstatus = 1
-            AND posting_date <= %s
-            ORDER BY posting_date DESC, creation DESC LIMIT 1
-        """
-        res = frappe.db.sql(blanking_sql, (bin_code, item, item, item, batch_val, moulding_date), as_dict=1)
-        print("\nSQL Search Result:")
-        print(json.dumps(res, indent=4, default=str))
-    else:
-        print("\nMPE not found for lot 25J08U06")
+        print(f"Name: {e.name}, Bin: {e.bin_code}, Item: {e.item_produced}, Batch: {e.spp_batch_number}, Created: {e.creation}, Status: {e.docstatus}")
+
+    # One MPE per lot, crossed with every bin. For each pair the database picks the bin's
+    # first batch number from batch_details and the latest blanking entry matching the
+    # item or that batch, so only the matching row comes back
+    rows = frappe.db.sql("""
+        SELECT *
+        FROM (
+            SELECT
+                mpe.scan_lot_number, mpe.name as mpe_name, mpe.moulding_date, mpe.item_to_produce as mpe_item,
+                mpe.batch_details, mpe.creation as mpe_creation, mpe.compound,
+                bins.bin_code as search_bin, IFNULL(bd.spp_batch_number, '') as mpe_batch,
+                b.name, b.employee, b.item_produced, b.item_to_produce, b.t_item_to_produce,
+                b.spp_batch_number, b.posting_date, b.creation,
+                ROW_NUMBER() OVER (
+                    PARTITION BY mpe.name, bins.bin_code
+                    ORDER BY b.posting_date DESC, b.creation DESC
+                ) as match_rank
+            FROM (
+                SELECT name, scan_lot_number, moulding_date, item_to_produce, batch_details, creation, compound,
+                    ROW_NUMBER() OVER (PARTITION BY scan_lot_number ORDER BY creation) as lot_rank
+                FROM `tabMoulding Production Entry`
+                WHERE scan_lot_number IN %(lots)s
+            ) mpe
+            JOIN JSON_TABLE(%(bins_json)s, '$[*]' COLUMNS (bin_code VARCHAR(140) PATH '$')) bins
+            LEFT JOIN (
+                SELECT m.name as mpe_name, j.bin, j.spp_batch_number,
+                    ROW_NUMBER() OVER (PARTITION BY m.name, j.bin ORDER BY j.ord) as batch_rank
+                FROM `tabMoulding Production Entry` m,
+                JSON_TABLE(IFNULL(m.batch_details, '[]'), '$[*]' COLUMNS (
+                    ord FOR ORDINALITY,
+                    bin VARCHAR(140) PATH '$.bin',
+                    spp_batch_number VARCHAR(140) PATH '$.spp_batch_number'
+                )) j
+                WHERE m.scan_lot_number IN %(lots)s
+                AND j.bin IN %(bins)s
+            ) bd ON bd.mpe_name = mpe.name AND bd.bin = bins.bin_code AND bd.batch_rank = 1
+            LEFT JOIN `tabBlanking DC Entry` b
+                ON b.bin_code = bins.bin_code
+                AND b.docstatus = 1
+                AND b.posting_date <= mpe.moulding_date
+                AND (
+                    b.item_produced = mpe.item_to_produce
+                    OR b.item_to_produce = mpe.item_to_produce
+                    OR b.t_item_to_produce = mpe.item_to_produce
+                    OR b.spp_batch_number = IFNULL(bd.spp_batch_number, '')
+                )
+            WHERE mpe.lot_rank = 1
+        ) matches
+        WHERE match_rank = 1
+    """, {"bins": tuple(bin_codes), "bins_json": json.dumps(bin_codes), "lots": tuple(lots)}, as_dict=1)
+
+    rows_by_lot = {}
+    for row in rows:
+        rows_by_lot.setdefault(row.scan_lot_number, {})[row.search_bin] = row
+
+    for lot_no in lots:
+        lot_rows = rows_by_lot.get(lot_no)
+
+        if not lot_rows:
+            print(f"\nMPE not found for lot {lot_no}")
+            continue
+
+        first = next(iter(lot_rows.values()))
+        mpe = {
+            "name": first.mpe_name,
+            "moulding_date": first.moulding_date,
+            "item_to_produce": first.mpe_item,
+            "batch_details": first.batch_details,
+            "creation": first.mpe_creation,
+            "compound": first.compound
+        }
+
+        print(f"\nMPE Details for lot {lot_no}:")
+        for key, value in mpe.items():
+            print(f"  {key}: {value}")
+
+        for bin_code in bin_codes:
+            row = lot_rows[bin_code]
+
+            print(f"\nExtracted Batch No from MPE for bin {bin_code}: {row.mpe_batch}")
+
+            print("\nSQL Search Result:")
+            if row.name:
+                print({
+                    key: row[key]
+                    for key in (
+                        "name", "employee", "item_produced", "item_to_produce", "t_item_to_produce",
+                        "spp_batch_number", "posting_date", "creation"
+                    )
+                })
+            else:
+                print("No matching blanking entry")
 
 if __name__ == "__main__":
     investigate()
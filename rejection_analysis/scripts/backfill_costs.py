@@ -7,61 +7,119 @@ Run with: bench --site spp15.local execute rejection_analysis.scripts.backfill_c
 import frappe
 from frappe.utils import flt
 
+# Child tables costed by DailyRejectionReport.calculate_rejection_costs:
+# (doctype, item code field, rejected qty field, cost field)
+COST_TABLES = (
+    ("Incoming Inspection Report Item", "item", "rejected_qty", "rejection_cost"),
+    ("Final Inspection Report Item", "item", "final_rej_qty", "fvi_rejection_cost"),
+    ("Lot Inspection Report Item", "item_code", "rejected_qty", "total_rejection_cost"),
+)
+
+# Reports costed and committed per batch
+BACKFILL_PAGE_SIZE = 500
+
 def backfill_all_costs():
     """Update all Daily Rejection Reports with cost data"""
-    
-    # Get all Daily Rejection Reports
-    reports = frappe.get_all("Daily Rejection Report", 
-        fields=["name", "report_date"],
-        order_by="report_date desc"
+    from rejection_analysis.rejection_analysis.api import fetch_remote_item_prices_batch
+    from rejection_analysis.rejection_analysis.cost_analysis_api import get_remote_pricing_config
+    from rejection_analysis.rejection_analysis.doctype.daily_rejection_report.daily_rejection_report import (
+        get_pricing_item_code
     )
     
-    print(f"Found {len(reports)} Daily Rejection Reports to update")
+    total = frappe.db.count("Daily Rejection Report")
+    
+    # Reports are skipped when any incoming item already has a cost, as before,
+    # but the check runs in SQL instead of loading every report
+    reports = frappe.db.sql_list("""
+        SELECT drr.name
+        FROM `tabDaily Rejection Report` drr
+        WHERE NOT EXISTS (
+            SELECT 1 FROM `tabIncoming Inspection Report Item` ii
+            WHERE ii.parent = drr.name
+            AND ii.parenttype = 'Daily Rejection Report'
+            AND ii.rejection_cost > 0
+        )
+        ORDER BY drr.report_date DESC
+    """)
+    
+    print(f"Found {total} Daily Rejection Reports, {len(reports)} without costs")
+    
+    remote_url, api_key, api_secret = get_remote_pricing_config()
+    
+    if not reports or not (remote_url and api_key and api_secret):
+        print("Nothing to update" if not reports else "Remote pricing is not configured")
+        return {"total": total, "updated": 0, "errors": 0}
+    
+    # Shared across pages so each item is translated and priced only once
+    f_items = {}
+    pricing_map = {}
     
     updated = 0
     errors = 0
+    updated_rows = 0
     
-    for report_info in reports:
+    # Work in pages of reports, committing each, so memory and transaction size stay bounded
+    for start in range(0, len(reports), BACKFILL_PAGE_SIZE):
+        page = reports[start:start + BACKFILL_PAGE_SIZE]
+        
         try:
-            # Load the document
-            doc = frappe.get_doc("Daily Rejection Report", report_info.name)
+            # Load the costed child rows of the page in one query per child table
+            child_rows = {}
+            for doctype, code_field, qty_field, cost_field in COST_TABLES:
+                child_rows[doctype] = frappe.db.sql(f"""
+                    SELECT name, parent, `{code_field}` as item_code, IFNULL(`{qty_field}`, 0) as qty
+                    FROM `tab{doctype}`
+                    WHERE parenttype = 'Daily Rejection Report'
+                    AND parent IN %(reports)s
+                    AND IFNULL(`{code_field}`, '') != ''
+                """, {"reports": tuple(page)}, as_dict=True)
             
-            # Check if costs already calculated (skip if yes)
-            has_costs = False
-            if doc.incoming_inspection_items:
-                has_costs = any(flt(item.rejection_cost) > 0 for item in doc.incoming_inspection_items)
+            # Price the page's new items with one batched remote fetch
+            for rows in child_rows.values():
+                for row in rows:
+                    if row.item_code not in f_items:
+                        f_items[row.item_code] = get_pricing_item_code(row.item_code)
             
-            if has_costs:
-                print(f"  ✓ {report_info.name} already has costs, skipping")
-                continue
+            unpriced = {f_item for f_item in f_items.values() if f_item and f_item not in pricing_map}
+            if unpriced:
+                rates = fetch_remote_item_prices_batch(list(unpriced), remote_url, api_key, api_secret)
+                pricing_map.update({f_item: rates.get(f_item, 0) for f_item in unpriced})
             
-            # Calculate costs
-            doc.calculate_rejection_costs()
+            # Reports in the page that had at least one child row written
+            page_updated = set()
             
-            # Save without validation (to avoid date issues)
-            doc.flags.ignore_validate = True
-            doc.save()
+            for doctype, code_field, qty_field, cost_field in COST_TABLES:
+                updates = {}
+                for row in child_rows[doctype]:
+                    f_item = f_items[row.item_code]
+                    if f_item:
+                        unit_cost = pricing_map.get(f_item, 0)
+                        updates[row.name] = {"unit_cost": unit_cost, cost_field: flt(row.qty) * unit_cost}
+                        page_updated.add(row.parent)
+                
+                if updates:
+                    frappe.db.bulk_update(doctype, updates, update_modified=False)
+                    updated_rows += len(updates)
             
-            updated += 1
-            print(f"  ✅ Updated {report_info.name} ({report_info.report_date})")
+            frappe.db.commit()
+            updated += len(page_updated)
+            print(f"  ✅ Updated {len(page_updated)} of reports {start + 1}-{start + len(page)} of {len(reports)}")
             
         except Exception as e:
-            errors += 1
-            print(f"  ❌ Error updating {report_info.name}: {str(e)}")
-    
-    # Commit all changes
-    frappe.db.commit()
+            frappe.db.rollback()
+            errors += len(page)
+            print(f"  ❌ Error updating reports {start + 1}-{start + len(page)}: {str(e)}")
     
     print(f"\n{'='*60}")
     print(f"Summary:")
-    print(f"  Total Reports: {len(reports)}")
-    print(f"  Updated: {updated}")
+    print(f"  Total Reports: {total}")
+    print(f"  Updated: {updated} ({updated_rows} item rows)")
     print(f"  Errors: {errors}")
-    print(f"  Skipped: {len(reports) - updated - errors}")
+    print(f"  Skipped: {total - updated - errors}")
     print(f"{'='*60}")
     
     return {
-        "total": len(reports),
+        "total": total,
         "updated": updated,
         "errors": errors
     }
@@ -5,15 +5,22 @@ doc = frappe.get_last_doc('Daily Rejection Report')
 print(f'Report: {doc.name}, Date: {doc.report_date}')
 print(f'Lot items: {len(doc.lot_inspection_items)}')
 
-if doc.lot_inspection_items:
-    item = doc.lot_inspection_items[0]
+# Inspected quantities for every referenced Inspection Entry in one query
+ie_names = {row.inspection_entry for row in doc.lot_inspection_items if row.inspection_entry}
+ie_qty = dict(frappe.db.sql("""
+    SELECT name, total_inspected_qty_nos
+    FROM `tabInspection Entry`
+    WHERE name IN %s
+""", (tuple(ie_names),))) if ie_names else {}
+
+for item in doc.lot_inspection_items:
     print(f'\nItem: {item.item_code}')
     print(f'IE: {item.inspection_entry}')
     print(f'Inspected Qty (child table): {item.inspected_qty}')
     print(f'Unit Cost: {item.unit_cost}')
     
     if item.inspection_entry:
-        inspected = frappe.db.get_value('Inspection Entry', item.inspection_entry, 'total_inspected_qty_nos')
+        inspected = ie_qty.get(item.inspection_entry, 0)
         print(f'Inspected Qty (IE): {inspected}')
         
         if inspected: